@@ -54,6 +54,7 @@ variables that belongs to provide_ret.
 # It's not able to manage several require (nargs) variable.
 # It's not able to manage path
 
+import sys
 import logging
 import json
 
@@ -66,6 +67,9 @@ logger = logging.getLogger(__name__)
 # represents provide_ret value.
 SPECIAL_REQUIRE_RETURN_NAME = "return"
 
+# Types of variables filled with provide hosts
+HOST_TYPES = ('armonic_this_host', 'armonic_hosts', 'armonic_host')
+
 # Describe the step that sent (through the generator) values used for
 # the deployment
 STEP_DEPLOYMENT_VALUES = "deployment_values"
@@ -101,19 +105,91 @@ class PathNotFound(SmartException):
     pass
 
 
+class VariableIndex(object):
+    """The variables of a deployment, indexed by xpath to find back
+    the variable of a from_xpath."""
+
+    def __init__(self):
+        self._variables = []
+        self._by_xpath = {}
+        # Variables whose from_xpath has not been found yet
+        self._waiting = {}
+
+    def append(self, variable):
+        self._variables.append(variable)
+        # The first variable created with an xpath is used
+        if variable.xpath not in self._by_xpath:
+            self._by_xpath[variable.xpath] = variable
+            for v in self._waiting.pop(variable.xpath, []):
+                v._unbind()
+
+    def by_xpath(self, xpath):
+        """:rtype: :class:`Variable` or None"""
+        return self._by_xpath.get(xpath)
+
+    def wait(self, xpath, variable):
+        """Unbind variable when a variable with this xpath is added."""
+        self._waiting.setdefault(xpath, []).append(variable)
+
+    def __iter__(self):
+        return iter(self._variables)
+
+    def __len__(self):
+        return len(self._variables)
+
+
+class ScopeVariables(list):
+    """The variables of a require scope, indexed by name."""
+
+    def __init__(self, variables=[]):
+        list.__init__(self)
+        self._by_name = {}
+        for v in variables:
+            self.append(v)
+
+    def append(self, variable):
+        list.append(self, variable)
+        same_name = self._by_name.setdefault(variable.name, [])
+        # Variables of this scope with the same name have to be bound
+        # again to take the new variable into account
+        for v in same_name:
+            if v.from_require._scope_variables is self:
+                v._unbind()
+        same_name.append(variable)
+
+    def by_name(self, name):
+        """:rtype: [:class:`Variable`]"""
+        return self._by_name.get(name, [])
+
+
 class Variable(object):
     """
     :param from_require: The require that holds this variable.
     :param belongs_provide_ret: True if this variable belongs to the provide_ret variable list of the from_require.
+
+    Resolved values are cached. The cache of a variable is cleared
+    when its value, its default or its bindings change, and so are the
+    caches of variables which depend on it.
     """
 
+    # Variables being resolved, used to know if a resolved value
+    # depends on where the resolution started (cycles)
+    _resolution_stack = []
+    _resolution_lowest = sys.maxint
+
     def __init__(self, name, from_require, xpath, from_xpath, default, value, required, type, error, belongs_provide_ret, modifier, extra):
+        # Resolved values by kind ('value' or 'default')
+        self._cache = {}
+        # Variables whose resolved value depends on this one
+        self._dependents = set()
+        self._bound = False
+        self._local_value = value
+        self._local_default = default
+
         self.from_require = from_require
         self.name = name
         self.xpath = xpath
         self.from_xpath = from_xpath
-        self._default = default
-        self._value = value
         self.required = required
         self.type = type
         self.error = error
@@ -191,6 +267,7 @@ class Variable(object):
         return this
 
     def update_from_json(self, dct_json):
+        binding = (self.name, self.from_xpath)
         for key, value in dct_json.items():
             # We don't update the value from the json generated by
             # agent. Indeed, the agent doen't have to change this
@@ -202,6 +279,11 @@ class Variable(object):
                     setattr(self, key, value)
                 except AttributeError:
                     logger.error("Error: Failed to update attr %s to %s" % (key, value))
+        if (self.name, self.from_xpath) != binding:
+            self._unbind()
+        else:
+            # The modifier may have changed
+            self._invalidate()
 
     @property
     def provided_by_xpath(self):
@@ -220,6 +302,26 @@ class Variable(object):
         else:
             return None
 
+    @property
+    def _value(self):
+        return self._local_value
+
+    @_value.setter
+    def _value(self, value):
+        old = self._local_value
+        self._local_value = value
+        if value is not old and (type(value) is not type(old) or value != old):
+            self._invalidate()
+
+    @property
+    def _default(self):
+        return self._local_default
+
+    @_default.setter
+    def _default(self, default):
+        self._local_default = default
+        self._invalidate()
+
     @property
     def default(self):
         return self._default
@@ -233,7 +335,8 @@ class Variable(object):
         """Returns the value resolved."""
         return self._resolved_break_cycles(
             lambda a: a._default,
-            lambda a: a.default_resolved)
+            lambda a: a.default_resolved,
+            'default')
 
     def _apply_modifier(self, value):
         """If self.modifier is not None, we currently apply it only on
@@ -268,20 +371,35 @@ class Variable(object):
         return self._apply_modifier(
             self._resolved_break_cycles(
                 lambda a: a._value,
-                lambda a: a.value_resolved))
+                lambda a: a.value_resolved,
+                'value'))
 
-    def _resolved_break_cycles(self, f_value, f_resolved):
+    def _resolved_break_cycles(self, f_value, f_resolved, kind):
         """Returns the value resolved and breaks potential cycles.
         :param f_value: is a function returing the local value.
         :param f_resolved: is a function returing the value resolved by other variables.
+        :param kind: the name of the cached resolved value
         """
         if self._resolving:
             # If this variable resolution is started, we stop the
             # recursion here without returning any value.
             # The self value can be use at the first iteration.
+            #
+            # Values resolved by variables above self in the
+            # resolution stack depend on where the resolution started:
+            # they can not be cached.
+            Variable._resolution_lowest = min(Variable._resolution_lowest,
+                                              Variable._resolution_stack.index(self))
             return None
-        else:
-            self._resolving = True
+        if kind in self._cache:
+            return self._cache[kind]
+
+        depth = len(Variable._resolution_stack)
+        Variable._resolution_stack.append(self)
+        lowest = Variable._resolution_lowest
+        Variable._resolution_lowest = sys.maxint
+        self._resolving = True
+        try:
             self._bind()
             resolved = self._resolve()
             if resolved is self:
@@ -292,9 +410,44 @@ class Variable(object):
                 # which may be not None!
                 if value is None:
                     value = f_value(self)
-
+        finally:
             self._resolving = False
-            return value
+            Variable._resolution_stack.pop()
+        if self.type in HOST_TYPES:
+            # Hosts are read from provides: they are never cached
+            Variable._resolution_lowest = -1
+        if Variable._resolution_lowest >= depth:
+            self._cache[kind] = value
+        Variable._resolution_lowest = min(lowest, Variable._resolution_lowest)
+        return value
+
+    def _invalidate(self):
+        """Clear the resolved values of this variable and of variables
+        depending on it."""
+        pending = [self]
+        seen = set()
+        while pending:
+            v = pending.pop()
+            if v in seen:
+                continue
+            seen.add(v)
+            v._cache.clear()
+            pending.extend(v._dependents)
+
+    def _unbind(self):
+        """Bindings will be computed again at the next resolution."""
+        self._bound = False
+        self._invalidate()
+
+    def _set_binding(self, attr, variable, dependent):
+        """Set the binding attr of self to variable. dependent is the
+        variable whose resolution uses the other one."""
+        if getattr(self, attr) is not variable:
+            setattr(self, attr, variable)
+            self._invalidate()
+        if variable is not None:
+            other = variable if dependent is self else self
+            other._dependents.add(dependent)
 
     def _resolve(self):
         """When bindings have been created, this method can be used to get a
@@ -344,15 +497,22 @@ class Variable(object):
         if self.type == 'armonic_host':
             return
 
+        # Bindings only change when _unbind is called
+        if self._bound:
+            return
+        self._bound = True
+
         # If the variable has a from_xpath attribute,
         # try to find back its value
         if self.from_xpath is not None:
-            for v in self.from_require.from_provide.Variables:
-                if v.xpath == self.from_xpath:
-                    self._set_by = v
-                    logger.debug("Variable [%s] value comes from [%s] (@%s) with value %s" % (
-                        self.xpath, v.xpath, id(v), v._value))
-                    return
+            variables = self.from_require.from_provide.Variables
+            v = variables.by_xpath(self.from_xpath)
+            if v is not None:
+                self._set_binding('_set_by', v, self)
+                logger.debug("Variable [%s] value comes from [%s] (@%s) with value %s" % (
+                    self.xpath, v.xpath, id(v), v._value))
+                return
+            variables.wait(self.from_xpath, self)
             logger.info("Variable [%s] from_xpath [%s] not found" % (
                 self.xpath, self.from_xpath))
 
@@ -360,14 +520,14 @@ class Variable(object):
             return
 
         if self.from_xpath is None:
-            for v in scope:
-                if self.name == v.name and self is not v:
+            for v in scope.by_name(self.name):
+                if self is not v:
                     logger.trace("Variable [%s] is suggested by [%s] with value %s" % (
                         self.xpath, v.xpath, v._value))
                     logger.trace("Variable [%s] is resolved by [%s] with value %s" % (
                         v.xpath, self.xpath, v._value))
-                    self._suggested_by = v
-                    v._resolved_by = self
+                    self._set_binding('_suggested_by', v, self)
+                    v._set_binding('_resolved_by', self, v)
 
     def pprint(self):
         return {"name": self.name,
@@ -445,13 +605,13 @@ class Require(object):
         # leave or cross. This is used to avoir variable value
         # propagation to require that comes from states.
         self.special = special
-        self._scope_variables = []
 
         # We copy variables dict from parent the scope.
         # They will be upgraded when requires are built.
         if from_provide.require is not None:
-            for v in from_provide.require._scope_variables:
-                self._scope_variables.append(v)
+            self._scope_variables = ScopeVariables(from_provide.require._scope_variables)
+        else:
+            self._scope_variables = ScopeVariables()
 
     @classmethod
     def from_json(cls, dct_json, **kwargs):
@@ -664,7 +824,7 @@ class Provide(ArmonicProvide):
                     to this provide.
     """
     # Contains all variables. This is used to find back from_xpath value.
-    Variables = []
+    Variables = VariableIndex()
 
     require = None
     """Contains the :class:`Require` that requires this provide."""
@@ -1301,7 +1461,7 @@ def smart_call(root_provide, values={}):
     optionnal_args)."""
 
     # We clear all variables used for a deployment
-    Provide.Variables = []
+    Provide.Variables = VariableIndex()
 
     scope = root_provide
     deployment = Deployment(scope, values)
@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 import socket
-import pickle
-import struct
 
-PACKET_INFO_SIZE = 5
+from armonic.protocol import send_frame, recv_frame, get_codec, \
+    log_record_from_primitive, DEFAULT_CODEC, NO_LOG_LEVEL
+from armonic.client.utils import GenerationCache, JobFuture, NOT_MODIFIED
 
 
 class AgentException(Exception):
@@ -23,12 +23,25 @@ class ClientSocket(object):
 
     :param handlers: To set handlers to forward agent logs
     :type handlers: [logging.Handler]
+    :param codec: name of the codec used to talk with the agent
+        (see :py:mod:`armonic.protocol`)
+    :param compression: if True, big frames are compressed
+    :param cache: if True, results of read methods are cached and
+        only fetched again if the agent generation changed (see
+        :py:class:`armonic.client.utils.GenerationCache`)
+
+    Only records whose level is accepted by at least one handler are
+    sent by the agent.
 
     """
-    def __init__(self, host="127.0.0.1", port=8000, handlers=[]):
+    def __init__(self, host="127.0.0.1", port=8000, handlers=[], codec=DEFAULT_CODEC,
+                 compression=True, cache=True):
         self._host = host
         self._port = port
         self.handlers = handlers
+        self.codec = get_codec(codec)
+        self.compression = compression
+        self.cache = GenerationCache() if cache else None
 
     def _connect(self):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -49,9 +62,27 @@ class ClientSocket(object):
         """Make a call to the agent. See
         :py:class:`armonic.lifecycle.LifecycleManager` to know which methods can
         be called."""
-        request = {'method': method, 'args': args, 'kwargs': kwargs}
+        if self.cache is None:
+            return self._call(method, args, kwargs)[1]
+        return self.cache.call(method, args, kwargs,
+                               lambda generation: self._call(method, args, kwargs, generation))
+
+    def _call(self, method, args, kwargs, if_generation=None):
+        """:rtype: (generation, value)"""
+        request = {'method': method, 'args': args, 'kwargs': kwargs,
+                   'log_level': self.log_level,
+                   'compress': self.compression}
+        if if_generation is not None:
+            request['if_generation'] = if_generation
         return self._send_and_receive(request)
 
+    @property
+    def log_level(self):
+        """The minimum log level asked to the agent."""
+        if not self.handlers:
+            return NO_LOG_LEVEL
+        return min(h.level for h in self.handlers)
+
     def info(self):
         return self.call("info")
 
@@ -76,6 +107,17 @@ class ClientSocket(object):
     def provide(self, provide_xpath):
         return self.call("provide", provide_xpath=provide_xpath)
 
+    def provide_search(self, tags=[], text=None, primitive=False, offset=0, limit=50):
+        return self.call("provide_search", tags=tags, text=text,
+                         primitive=primitive, offset=offset, limit=limit)
+
+    def process_outputs(self):
+        return self.call("process_outputs")
+
+    def process_output(self, output_id, offset=0, size=64 * 1024):
+        return self.call("process_output", output_id=output_id,
+                         offset=offset, size=size)
+
     def provide_call_path(self, provide_xpath):
         return self.call("provide_call_path", provide_xpath=provide_xpath)
 
@@ -89,6 +131,16 @@ class ClientSocket(object):
                          provide_xpath_uri=provide_xpath_uri,
                          requires=requires, path_idx=path_idx)
 
+    def provide_call_async(self, provide_xpath_uri, requires=[], path_idx=0):
+        """Start a provide call on the agent.
+
+        :rtype: :py:class:`armonic.client.utils.JobFuture`
+        """
+        job_id = self.call("provide_call_async",
+                           provide_xpath_uri=provide_xpath_uri,
+                           requires=requires, path_idx=path_idx)
+        return JobFuture(self, job_id)
+
     def state(self, xpath, doc=False):
         return self.call("state", xpath=xpath, doc=doc)
 
@@ -97,6 +149,12 @@ class ClientSocket(object):
                          xpath=xpath,
                          requires=requires)
 
+    def state_goto_plans(self):
+        return self.call("state_goto_plans")
+
+    def state_goto_resume(self, xpath):
+        return self.call("state_goto_resume", xpath=xpath)
+
     def state_goto_path(self, state_xpath):
         return self.call("state_goto_path",
                          state_xpath=state_xpath)
@@ -105,47 +163,32 @@ class ClientSocket(object):
         return self.call("state_current",
                          xpath=xpath)
 
-    def _receive_string(self):
-        packer = struct.Struct("!I?")
-        recv_size = 0
-        p = ""
-        while recv_size < packer.size:
-            p += self._socket.recv(packer.size - recv_size)
-            recv_size = len(p)
-        try:
-            size = packer.unpack(p)[0]
-        except struct.error:
-            print "Struct error with packet:"
-            print p
-            raise
-        last = packer.unpack(p)[1]
-        ret = self._socket.recv(size)
-        recv_size = len(ret)
-        while recv_size < size:
-            ret += self._socket.recv(size - recv_size)
-            recv_size = len(ret)
-        ret = pickle.loads(ret)
-        return (last, ret)
-
     def _send_and_receive(self, request):
         self._connect()
-        self._socket.sendall(pickle.dumps(request))
-        ret = self._receive()
-        pRet = ret  # pickle.loads(ret)
-        self._socket.close()
-        if "exception" in pRet:
-            raise pRet['exception']
-        elif "return" in pRet:
-            return pRet['return']
+        try:
+            send_frame(self._socket, request, self.codec, last=True,
+                       compression=self.compression)
+            ret = self._receive()
+        finally:
+            self._socket.close()
+        if "exception" in ret:
+            raise AgentException("%s: %s" % (ret['exception']['code'],
+                                              ret['exception']['message']))
+        elif "not_modified" in ret:
+            return (ret['generation'], NOT_MODIFIED)
+        elif "return" in ret:
+            return (ret.get('generation'), ret['return'])
         else:
             raise AgentException("Error: agent send no response!")
 
     def _receive(self):
         while True:
-            (last_msg, r) = self._receive_string()
+            (last_msg, codec, r) = recv_frame(self._socket)
             if last_msg:
                 break
-            for h in self.handlers:
-                if r.levelno >= h.level:
-                    h.handle(r)
+            for primitive in r:
+                record = log_record_from_primitive(primitive)
+                for h in self.handlers:
+                    if record.levelno >= h.level:
+                        h.handle(record)
         return r
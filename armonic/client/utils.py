@@ -1,3 +1,201 @@
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from armonic.jobs import FINISHED, CANCELLED
+from armonic.protocol import log_record_from_primitive
+
+
+NOT_MODIFIED = object()
+"""Returned by transports when the agent answers that a result is not
+modified since the requested generation."""
+
+CACHEABLE_METHODS = frozenset(['info', 'lifecycle', 'state', 'state_current',
+                               'state_goto_path', 'state_goto_requires',
+                               'provide', 'provide_search', 'provide_call_path',
+                               'provide_call_requires', 'to_dot', 'uri',
+                               'xpath', 'to_xml'])
+"""Agent methods whose result can be cached by clients (they are
+conditional in :py:class:`armonic.serialize.Serialize`)."""
+
+
+class GenerationCache(object):
+    """A cache of agent results based on the agent generation (see
+    :py:class:`armonic.utils.Generation`).
+
+    A result is stored with the generation the agent sent with it.
+    When the same call is done again, the cached generation is sent
+    to the agent which only sends back the result if the generation
+    changed.
+
+    A cache must only be used with one agent.
+
+    :param size: maximum number of cached results
+    """
+    def __init__(self, size=256, methods=CACHEABLE_METHODS):
+        self.size = size
+        self.methods = methods
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, args, kwargs):
+        return json.dumps([method, args, kwargs], sort_keys=True)
+
+    def get(self, key):
+        """:rtype: (generation, value) or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, generation, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (generation, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def call(self, method, args, kwargs, send):
+        """Call method through the cache.
+
+        :param send: a function taking the generation of the cached
+            result (or None) and returning (generation, value) where
+            value is :py:data:`NOT_MODIFIED` if the agent didn't send
+            the result. generation is None if the agent doesn't
+            support generations.
+        """
+        if method not in self.methods:
+            return send(None)[1]
+        key = self.key(method, args, kwargs)
+        entry = self.get(key)
+        generation, value = send(entry[0] if entry is not None else None)
+        if value is NOT_MODIFIED:
+            if entry is None:
+                raise ValueError("Agent answered not modified to an "
+                                 "unconditional call of %s" % method)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+        self.misses += 1
+        if generation is not None:
+            self.set(key, generation, copy.deepcopy(value))
+        return value
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class JobFuture(object):
+    """The result of a job running on an agent (see
+    :py:mod:`armonic.jobs`).
+
+    :param client: an object with a call(method, *args, **kwargs)
+        method, like :py:class:`armonic.client.sock.ClientSocket` or
+        :py:class:`armonic.xmpp.client.XMPPAgentApi`
+    :param job_id: the job id returned by the agent
+    :param poll_interval: time in seconds between two status requests
+    """
+    def __init__(self, client, job_id, poll_interval=1.0):
+        self.client = client
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+        self._status = None
+        self._log_offset = 0
+
+    def status(self):
+        """Fetch the job status from the agent.
+
+        :rtype: job primitive
+        """
+        if self._status is None or self._status['status'] not in FINISHED:
+            self._status = self.client.call("job_status", self.job_id)
+        return self._status
+
+    def done(self):
+        return self.status()['status'] in FINISHED
+
+    def logs(self):
+        """Fetch log records emitted by the job since the last call.
+
+        :rtype: [logging.LogRecord]
+        """
+        status = self.client.call("job_status", self.job_id,
+                                  log_offset=self._log_offset)
+        self._log_offset += len(status['logs'])
+        return [log_record_from_primitive(p) for p in status['logs']]
+
+    def cancel(self):
+        """Cancel the job. Return True if the job is cancelled, False if
+        it is finished or if it will be cancelled by the agent later."""
+        self._status = self.client.call("job_cancel", self.job_id)
+        return self._status['status'] == CANCELLED
+
+    def wait(self, timeout=None):
+        """Wait until the job is finished.
+
+        :raises JobTimeout: if the job is not finished after timeout
+            seconds
+        """
+        wait_jobs([self], timeout)
+
+    def result(self, timeout=None):
+        """Wait until the job is finished and return its result. If
+        the job failed, the agent exception is raised by the client."""
+        self.wait(timeout)
+        return self.client.call("job_result", self.job_id)
+
+    def __repr__(self):
+        return "<JobFuture:%s>" % self.job_id
+
+
+def wait_jobs(futures, timeout=None, poll_interval=None):
+    """Wait until all futures are finished by polling them in turn
+    from the current thread.
+
+    :raises JobTimeout: if jobs are not finished after timeout seconds
+    """
+    if poll_interval is None:
+        poll_interval = min([f.poll_interval for f in futures] or [1.0])
+    start = time.time()
+    pending = list(futures)
+    while True:
+        pending = [f for f in pending if not f.done()]
+        if not pending:
+            return
+        if timeout is not None and time.time() - start + poll_interval > timeout:
+            raise JobTimeout("Jobs %s are not finished" % ", ".join(f.job_id for f in pending))
+        time.sleep(poll_interval)
+
+
+def iter_process_output(client, output_id, offset=0, size=64 * 1024,
+                        follow=False, poll_interval=1.0):
+    """Read a process output of an agent by chunks.
+
+    :param follow: if True, wait for new output until the process is
+        finished
+    :rtype: a generator of output chunks
+    """
+    while True:
+        chunk = client.call("process_output", output_id, offset, size)
+        offset = chunk['next_offset']
+        if chunk['data']:
+            yield chunk['data']
+        elif chunk['finished'] or not follow:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
 def require_validation_error(dct):
     """Take the return dict of provide_call_validate and return a list of
     tuple that contains (xpath, error_string)"""
@@ -4,6 +4,7 @@ import logging
 import logging.handlers
 import traceback
 import copy
+import threading
 
 from armonic.utils import get_first_ip
 
@@ -38,6 +39,12 @@ MASTER_CONF = [os.path.expanduser("~/.config/armonic/master.conf"), "/etc/armoni
 PUBLIC_IP = "localhost"
 """Public IP that should be used to contact deployed service. It has to be set by command line."""
 
+PROCESS_OUTPUT_DIR = None
+"""Directory where the full output of processes is written. If None,
+only the end of outputs is kept in memory (see
+:py:class:`armonic.process.ProcessThread`).
+"""
+
 # We set a null handler to avoid warning message if no handler is
 # specified.
 logging.getLogger("armonic").addHandler(logging.NullHandler())
@@ -130,6 +137,100 @@ class XpathFilter(logging.Filter):
         return True
 
 
+class BatchingHandler(logging.Handler):
+    """A handler that buffers records and emits them by batch.
+
+    The buffer is flushed when it contains :py:attr:`capacity`
+    records, when their size exceeds :py:attr:`max_size` bytes or
+    every :py:attr:`flush_interval` seconds.
+
+    Subclasses have to implement :py:meth:`prepare` which converts a
+    record to the item stored in the buffer and
+    :py:meth:`send_batch` which sends a list of items. The size of
+    an item is estimated by :py:meth:`item_size`.
+
+    The handler must be closed to flush remaining records and stop
+    the flushing thread.
+    """
+    capacity = 200
+    max_size = 32 * 1024
+    flush_interval = 0.5
+
+    def __init__(self, capacity=None, max_size=None, flush_interval=None):
+        logging.Handler.__init__(self)
+        if capacity is not None:
+            self.capacity = capacity
+        if max_size is not None:
+            self.max_size = max_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffer_size = 0
+        self._closed = threading.Event()
+        self._flusher = None
+        if self.flush_interval:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name="%s-flusher" % self.__class__.__name__)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def prepare(self, record):
+        raise NotImplementedError()
+
+    def item_size(self, item):
+        return len(str(item))
+
+    def send_batch(self, items):
+        raise NotImplementedError()
+
+    def has_pending(self):
+        """Return True if there is something to send at the next
+        flush."""
+        return bool(self.buffer)
+
+    def emit(self, record):
+        try:
+            item = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if item is None:
+            return
+        self.buffer.append(item)
+        self.buffer_size += self.item_size(item)
+        if (len(self.buffer) >= self.capacity or
+                self.buffer_size >= self.max_size):
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.has_pending():
+                items = self.buffer
+                self.buffer = []
+                self.buffer_size = 0
+                try:
+                    self.send_batch(items)
+                except Exception:
+                    # Records are lost if they can't be sent
+                    pass
+        finally:
+            self.release()
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._closed.wait(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        if (self._flusher is not None and
+                self._flusher is not threading.current_thread()):
+            self._flusher.join()
+        self.flush()
+        logging.Handler.close(self)
+
+
 def expose(f):
     "Decorator to set exposed flag on a function."
     f.exposed = True
@@ -141,6 +242,34 @@ def is_exposed(f):
     return getattr(f, 'exposed', False)
 
 
+def conditional(f):
+    """Decorator to set conditional flag on a function. The result of
+    a conditional function only depends on its arguments and on the
+    agent generation (see :py:class:`armonic.utils.Generation`). It
+    can then be called with an if_generation argument to avoid
+    sending back a result the client already has."""
+    f.conditional = True
+    return f
+
+
+def is_conditional(f):
+    "Test whether a function result can be cached by clients."
+    return getattr(f, 'conditional', False)
+
+
+def mutating(f):
+    """Decorator to set mutating flag on a function. A mutating
+    function changes lifecycle states or provides: it can't run while
+    a job is running (see :py:mod:`armonic.jobs`)."""
+    f.mutating = True
+    return f
+
+
+def is_mutating(f):
+    "Test whether a function changes the agent state."
+    return getattr(f, 'mutating', False)
+
+
 def format_input_variables(requires=[]):
     """If the requires format is ([("//xpath/to/variable_name", "value")], X),
     translate to ([("//xpath/to/variable_name", {0:value})], X)
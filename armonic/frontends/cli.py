@@ -180,6 +180,16 @@ class Cli(object):
 
         pprint.pprint(self.client.state_goto(args.state_xpath_uri, args_require))
 
+    def cmd_state_goto_plans(self, args):
+        for plan in self.client.state_goto_plans():
+            print "%s -> %s: %d/%d steps done" % (plan['xpath'], plan['state'],
+                                                  plan['done'], len(plan['path']))
+            if plan['error']:
+                print "  error: %s" % plan['error']
+
+    def cmd_state_goto_resume(self, args):
+        pprint.pprint(self.client.state_goto_resume(args.lifecycle_xpath))
+
     def cmd_provide(self, args):
         if args.path:
             ret = self.client.provide_call_path(args.provide_xpath)
@@ -202,6 +212,20 @@ class Cli(object):
                         provide_to_table(provide)
 
 
+    def cmd_provide_search(self, args):
+        ret = self.client.provide_search(tags=args.tag, text=args.text,
+                                         primitive=args.long_description,
+                                         offset=args.offset, limit=args.limit)
+        for provide in ret['provides']:
+            if args.long_description:
+                print
+                print provide['xpath']
+                provide_to_table(provide)
+            else:
+                print provide
+        if ret['total'] > args.offset + len(ret['provides']):
+            print "... %d provides found" % ret['total']
+
     def cmd_provide_call(self, args):
         args_require = None
         if args.require is not None:
@@ -271,6 +295,13 @@ class Cli(object):
         group.add_argument('--json',dest="json_require" , type=str, help="Use raw JSON require format (useful for debugging, see provide_call API for more informations)")
         parser_state_goto.set_defaults(func=lambda a : self.cmd_state_goto(a))
 
+        parser_state_goto_plans = self.subparsers.add_parser('state-goto-plans', help='Show state-goto which have not been completed. Use state-goto-resume to resume them (interrupted ones are resumed on start by agents run with --resume-plans).', parents=self.parent_parsers)
+        parser_state_goto_plans.set_defaults(func=lambda a : self.cmd_state_goto_plans(a))
+
+        parser_state_goto_resume = self.subparsers.add_parser('state-goto-resume', help='Resume the state-goto which has not been completed.', parents=self.parent_parsers)
+        parser_state_goto_resume.add_argument('lifecycle_xpath' , type=str, help='a xpath that matches lifecycles')
+        parser_state_goto_resume.set_defaults(func=lambda a : self.cmd_state_goto_resume(a))
+
 
         parser_provide = self.subparsers.add_parser('provide', help='List provides.', parents=self.parent_parsers)
         parser_provide.add_argument('provide_xpath' , type=str, help='a xpath that matches Provide resources')
@@ -280,6 +311,14 @@ class Cli(object):
 
         parser_provide.set_defaults(func=lambda a : self.cmd_provide(a))
 
+        parser_provide_search = self.subparsers.add_parser('provide-search', help='Search provides by tags and text.', parents=self.parent_parsers)
+        parser_provide_search.add_argument('text' , type=str, nargs='?', help='words of the provide name, label or help')
+        parser_provide_search.add_argument('--tag','-t',type=str,action='append',default=[],help="a tag the provides must have")
+        parser_provide_search.add_argument('--long-description','-l',action='store_true',help="Show long description")
+        parser_provide_search.add_argument('--offset',type=int,default=0,help="Index of the first provide to show")
+        parser_provide_search.add_argument('--limit',type=int,default=50,help="Maximum number of provides to show")
+        parser_provide_search.set_defaults(func=lambda a : self.cmd_provide_search(a))
+
         parser_provide_call = self.subparsers.add_parser('provide-call', help='Call a provide.', parents=self.parent_parsers)
         parser_provide_call.add_argument('xpath' , type=str, help='a xpath')
         parser_provide_call.add_argument('--check','-c',action='store_true',help="check if requires are valid. This calls provide_call_validation API method.")
@@ -0,0 +1,267 @@
+"""Asynchronous execution of long agent calls.
+
+A :py:class:`JobTable` runs calls in a worker thread and keeps their
+status and result during :py:attr:`JobTable.retention` seconds once
+they are finished. Clients submit a job, get its id immediately and
+then poll its status (see :py:class:`armonic.client.utils.JobFuture`).
+
+Jobs are run one at a time, in submission order, since they modify
+lifecycle states. A job holds :py:attr:`JobTable.lock` while it runs:
+synchronous calls which modify lifecycle states have to take it too.
+
+Log records emitted by a job are kept with the job instead of being
+sent to the clients connected meanwhile: log handlers forwarding
+records to clients must use :py:class:`OutsideJobFilter`.
+
+A running job can't be interrupted. When it is cancelled, the
+cancellation is effective at the next :py:func:`check_cancelled`
+call, which is done before each state transition.
+"""
+import time
+import uuid
+import Queue
+import logging
+import threading
+from contextlib import contextmanager
+
+from armonic.protocol import log_record_to_primitive
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+"""Status of jobs that won't change anymore."""
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class JobNotFinished(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+_current = threading.local()
+
+
+def current_job():
+    """Return the job running in the current thread or None."""
+    return getattr(_current, 'job', None)
+
+
+@contextmanager
+def job_context(job):
+    """Run the block as part of job. Threads started by a job have to
+    use it so that their log records are kept in the job."""
+    previous = current_job()
+    _current.job = job
+    try:
+        yield
+    finally:
+        _current.job = previous
+
+
+def check_cancelled():
+    """Raise :py:class:`JobCancelled` if the job running in the
+    current thread has been cancelled. Outside jobs, this does
+    nothing."""
+    job = current_job()
+    if job is not None and job.cancel_requested:
+        raise JobCancelled("Job %s has been cancelled" % job.id)
+
+
+class OutsideJobFilter(logging.Filter):
+    """Drop records emitted by a job. They are only available from the
+    job (see :py:attr:`Job.logs`)."""
+    def filter(self, record):
+        return current_job() is None
+
+
+class JobLogHandler(logging.Handler):
+    """Keep records emitted by a job in the job."""
+    def emit(self, record):
+        job = current_job()
+        if job is not None:
+            try:
+                job.log(log_record_to_primitive(record))
+            except Exception:
+                self.handleError(record)
+
+
+_log_handler = None
+_log_handler_lock = threading.Lock()
+
+
+def _install_log_handler():
+    """Add the :py:class:`JobLogHandler` to the root logger once."""
+    global _log_handler
+    with _log_handler_lock:
+        if _log_handler is None:
+            _log_handler = JobLogHandler()
+            logging.getLogger().addHandler(_log_handler)
+
+
+class Job(object):
+    max_logs = 10000
+    """Maximum number of log records kept by a job. Next records are
+    dropped and counted in :py:attr:`logs_dropped`."""
+
+    def __init__(self, name, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = PENDING
+        self.result = None
+        self.exception = None
+        self.cancel_requested = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.logs = []
+        """Log records emitted by the job (see
+        :py:func:`armonic.protocol.log_record_to_primitive`)"""
+        self.logs_dropped = 0
+
+    def log(self, primitive):
+        if len(self.logs) < self.max_logs:
+            self.logs.append(primitive)
+        else:
+            self.logs_dropped += 1
+
+    def run(self):
+        self.started = time.time()
+        self.status = RUNNING
+        _current.job = self
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+            self.status = DONE
+        except JobCancelled as e:
+            logger.info("Job %s (%s) cancelled" % (self.id, self.name))
+            self.exception = e
+            self.status = CANCELLED
+        except Exception as e:
+            logger.exception(e)
+            self.exception = e
+            self.status = FAILED
+        finally:
+            _current.job = None
+            self.finished = time.time()
+
+    def to_primitive(self, log_offset=None):
+        """If log_offset is not None, log records of the job from
+        log_offset are returned in logs."""
+        primitive = {"id": self.id,
+                     "name": self.name,
+                     "status": self.status,
+                     "cancel_requested": self.cancel_requested,
+                     "created": self.created,
+                     "started": self.started,
+                     "finished": self.finished,
+                     "exception": None}
+        if self.exception is not None:
+            primitive["exception"] = {"code": self.exception.__class__.__name__,
+                                      "message": str(self.exception)}
+        if log_offset is not None:
+            primitive["logs"] = self.logs[log_offset:]
+            primitive["logs_dropped"] = self.logs_dropped
+        return primitive
+
+    def __repr__(self):
+        return "<Job:%s(%s,%s)>" % (self.id, self.name, self.status)
+
+
+class JobTable(object):
+    """Submit jobs and keep them until :py:attr:`retention` seconds
+    after they are finished.
+
+    :param retention: time in seconds finished jobs are kept
+    :param max_finished: maximum number of finished jobs kept
+    :param lock: the lock held while a job runs
+    """
+    def __init__(self, retention=3600, max_finished=1000, lock=None):
+        self.retention = retention
+        self.max_finished = max_finished
+        self.lock = lock if lock is not None else threading.Lock()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._worker = None
+
+    def submit(self, name, func, *args, **kwargs):
+        """Schedule the call func(*args, **kwargs).
+
+        :rtype: :py:class:`Job`
+        """
+        job = Job(name, func, args, kwargs)
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = job
+            if self._worker is None:
+                _install_log_handler()
+                self._worker = threading.Thread(target=self._work, name="jobs")
+                self._worker.daemon = True
+                self._worker.start()
+        self._queue.put(job)
+        logger.debug("Job %s submitted" % job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise JobNotFound("Job %s does not exist" % job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job. A pending job is immediately cancelled while a
+        running job is only cancelled at the next
+        :py:func:`check_cancelled` call.
+
+        :rtype: :py:class:`Job`
+        """
+        job = self.get(job_id)
+        with self._lock:
+            if job.status == PENDING:
+                job.status = CANCELLED
+                job.finished = time.time()
+            elif job.status == RUNNING:
+                job.cancel_requested = True
+        return job
+
+    def jobs(self):
+        with self._lock:
+            self._purge()
+            return sorted(self._jobs.values(), key=lambda j: j.created)
+
+    def _purge(self):
+        """Remove expired finished jobs. The lock must be held."""
+        finished = sorted([j for j in self._jobs.values() if j.status in FINISHED],
+                          key=lambda j: j.finished)
+        limit = time.time() - self.retention
+        for i, job in enumerate(finished):
+            if job.finished < limit or len(finished) - i > self.max_finished:
+                del self._jobs[job.id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status == CANCELLED:
+                    continue
+                job.status = RUNNING
+            logger.debug("Running job %s" % job)
+            with self.lock:
+                job.run()
+            logger.debug("Job %s finished" % job)
@@ -3,11 +3,14 @@ import logging
 import copy
 import sys
 import re
+from time import time
 from platform import uname
 
 import armonic.common
+from armonic.jobs import check_cancelled
 
-from armonic.utils import IterContainer, DoesNotExist, OS_TYPE, OsTypeAll, get_subclasses
+from armonic.utils import IterContainer, DoesNotExist, OS_TYPE, OsTypeAll, get_subclasses, \
+    Generation
 from armonic.common import ProvideError, format_input_variables
 from armonic.provide import Provide
 from armonic.variable import ValidationError
@@ -114,6 +117,11 @@ class State(XMLRessource):
     _lf_name = ""
     _instance = None
     supported_os_type = [OsTypeAll()]
+    idempotent = False
+    """If True, :py:meth:`State.enter` is not called when the state
+    is entered with the same requires values as the last time it has
+    been entered. The effects of enter must then remain after a
+    :py:meth:`State.leave`."""
 
     def _xml_tag(self):
         return self.name
@@ -192,8 +200,24 @@ class State(XMLRessource):
 
         :type requires: tuple of variable values and deployment info
         """
+        if self.idempotent and self._enter_unchanged(requires):
+            logger.info("State %s has already been entered with the same "
+                        "requires, skipping enter" % self)
+            return None
         return self._provide_call(self.enter, self.provide_enter, requires)
 
+    def _enter_unchanged(self, requires=[]):
+        """Return True if the enter requires filled with requires have
+        the same fingerprint as the last time the state was entered."""
+        last = self.provide_enter.history.last_entry()
+        if last is None or last.get('fingerprint') is None:
+            return False
+        self.provide_enter.fill(requires)
+        try:
+            return self.provide_enter.fingerprint() == last['fingerprint']
+        finally:
+            self.provide_enter._clear()
+
     def enter(self):
         """Called when a state is applied"""
         logger.debug("Entering state %s" % self)
@@ -271,6 +295,16 @@ class MetaState(State):
     implementations = []
 
 
+def _requires_from_json(requires):
+    """Restore integer indexes of variable values of requires loaded
+    from JSON."""
+    if not requires:
+        return requires
+    variables_values = [(xpath, dict((int(index), value) for index, value in values.items()))
+                        for (xpath, values) in requires[0]]
+    return [variables_values] + list(requires[1:])
+
+
 class Lifecycle(XMLRessource):
     """The Lifecycle of a service or application is represented
     by transitions between :class:`State` classes.
@@ -301,6 +335,7 @@ class Lifecycle(XMLRessource):
     initial_state = None
     """The initial state for this Lifecycle"""
     _persist = True
+    _plan = None
 
     def __new__(cls):
         instance = super(Lifecycle, cls).__new__(cls)
@@ -382,10 +417,16 @@ class Lifecycle(XMLRessource):
         return transitions
 
     def _persist_primitive(self):
-        return [state.name for state in self._stack]
+        return {'stack': [state.name for state in self._stack],
+                'plan': self._plan}
 
-    def _persist_load_primitive(self, stack):
+    def _persist_load_primitive(self, primitive):
         logger.debug("Loading %s previous states" % self)
+        if isinstance(primitive, list):
+            stack = primitive
+        else:
+            stack = primitive['stack']
+            self._plan = primitive.get('plan')
         _stack = []
         for state_name in stack:
             try:
@@ -396,6 +437,7 @@ class Lifecycle(XMLRessource):
                 return False
         if _stack:
             self._stack = _stack
+            Generation().bump()
             return True
         return False
 
@@ -463,6 +505,8 @@ class Lifecycle(XMLRessource):
         ret = state._enter_safe(requires)
         logger.debug("push state %s" % state)
         self._stack.append(state)
+        Generation().bump()
+        self._persist_dirty()
         logger.event({'event': 'state_applied',
                       'state': state.name,
                       'lifecycle': self.name})
@@ -471,6 +515,8 @@ class Lifecycle(XMLRessource):
     def _pop_state(self):
         if self._stack != []:
             t = self._stack.pop()
+            Generation().bump()
+            self._persist_dirty()
             t.leave()
 
     def _get_from_state_paths(self, from_state, to_state):
@@ -571,14 +617,70 @@ class Lifecycle(XMLRessource):
         requires = format_input_variables(requires)
         logger.debug("Goto state %s using path %i" % (state, path_idx))
         path = self.state_goto_path(state, path_idx=path_idx)
-        for (state, method) in path:
-            if method == "enter":
-                self._push_state(state, requires)
-            elif method == "leave":
-                if self.state_current() == state:
-                    self._pop_state()
-                else:
-                    raise StateNotApply(self.state_current())
+        self._plan = {'state': self._get_state_class(state).name,
+                      'path_idx': path_idx,
+                      'requires': requires,
+                      'path': [(s.name, method) for (s, method) in path],
+                      'done': 0,
+                      'started': int(time()),
+                      'error': None}
+        self._run_plan()
+
+    def _run_plan(self):
+        """Execute the remaining steps of the current plan.
+
+        The plan is written in the agent state before the first step
+        and after each completed step, so that an interrupted
+        state_goto can be resumed from the last completed step.
+        """
+        self._persist_dirty(sync=True)
+        plan = self._plan
+        requires = plan['requires']
+        try:
+            for (state_name, method) in plan['path'][plan['done']:]:
+                check_cancelled()
+                state = self.state_by_name(state_name)
+                if method == "enter":
+                    self._push_state(state, requires)
+                elif method == "leave":
+                    if self.state_current() == state:
+                        self._pop_state()
+                    else:
+                        raise StateNotApply(self.state_current())
+                plan['done'] += 1
+                self._persist_dirty(sync=True)
+        except Exception as e:
+            plan['error'] = "%s: %s" % (e.__class__.__name__, str(e).split("\n")[0])
+            self._persist_dirty(sync=True)
+            raise
+        self._plan = None
+        self._persist_dirty()
+
+    def state_goto_plan(self):
+        """Return the state_goto which has not been completed, because
+        it failed or because the agent stopped during it.
+
+        :return: the target state name, the path, the number of steps
+            done, the time the plan started and the error which
+            stopped it, or None if there is no pending plan
+        :rtype: dict
+        """
+        return self._plan
+
+    def state_goto_resume(self):
+        """Execute the remaining steps of the pending plan with the
+        requires it was started with.
+
+        :raises DoesNotExist: if there is no pending plan
+        """
+        if self._plan is None:
+            raise DoesNotExist("No state_goto to resume in %s" % self.name)
+        logger.info("Resuming state_goto %s of %s at step %d/%d" % (
+            self._plan['state'], self.name, self._plan['done'] + 1,
+            len(self._plan['path'])))
+        self._plan['error'] = None
+        self._plan['requires'] = _requires_from_json(self._plan['requires'])
+        self._run_plan()
 
     def state_goto_path_list(self, state):
         """Get the list of paths to go to State.
@@ -818,6 +920,51 @@ class LifecycleNotExist(Exception):
     pass
 
 
+class ProvideIndex(object):
+    """Inverted index of provides by tags and by words of their name,
+    label and help.
+
+    Provides are identified by their relative xpath.
+    """
+    def __init__(self):
+        self.provides = {}
+        self.tags = {}
+        self.words = {}
+
+    @staticmethod
+    def split_words(text):
+        return set(re.findall(r"\w+", text.lower()))
+
+    def add(self, lf, state, provide):
+        xpath = provide.get_xpath_relative()
+        self.provides[xpath] = (lf, state, provide)
+        for tag in provide.extra.get('tags', []):
+            self.tags.setdefault(tag, set()).add(xpath)
+        text = " ".join([provide.name,
+                         provide.extra.get('label', ""),
+                         provide.extra.get('help', "")])
+        for word in self.split_words(text):
+            self.words.setdefault(word, set()).add(xpath)
+
+    def search(self, tags=[], text=None):
+        """Return xpaths of provides having all tags and whose words
+        start with all words of text.
+
+        :rtype: [xpath]
+        """
+        xpaths = set(self.provides)
+        for tag in tags:
+            xpaths &= self.tags.get(tag, set())
+        if text:
+            for query in self.split_words(text):
+                matches = set()
+                for word, word_xpaths in self.words.items():
+                    if word.startswith(query):
+                        matches |= word_xpaths
+                xpaths &= matches
+        return sorted(xpaths)
+
+
 class LifecycleManager(XMLRessource):
     """The :class:`LifecyleManager` is used to manage :class:`Lifecyle`
     objects. It permits to interact with lifecycles by provinding xpaths.
@@ -851,6 +998,8 @@ class LifecycleManager(XMLRessource):
 
         self.lf_loaded = {}
         self.lf = {}
+        self._provide_index = None
+        self._provide_index_key = None
         for lf in get_subclasses(Lifecycle):
             if not lf.abstract:
                 logger.debug("Found Lifecycle %s" % lf)
@@ -1034,6 +1183,49 @@ class LifecycleManager(XMLRessource):
                      lf_name, state_name, requires))
         return self.lifecycle_by_name(lf_name).state_goto(state_name, requires)
 
+    def state_goto_plans(self):
+        """Return state_goto which have not been completed (see
+        :py:meth:`Lifecycle.state_goto_plan`).
+
+        :rtype: [(:class:`Lifecycle`, plan)]
+        """
+        return [(lf, lf.state_goto_plan())
+                for lf in self.lf_loaded.values()
+                if lf.state_goto_plan() is not None]
+
+    def state_goto_resume_interrupted(self):
+        """Resume the state_goto which have been interrupted by an
+        agent stop. This is done by agents on start when they are run
+        with --resume-plans. Plans stopped by an error are only
+        resumed by :py:meth:`state_goto_resume`.
+
+        :return: xpaths of lifecycles whose plan has been completed
+        :rtype: [xpath]
+        """
+        resumed = []
+        for lf, plan in self.state_goto_plans():
+            if plan['error'] is not None:
+                continue
+            try:
+                lf.state_goto_resume()
+            except Exception:
+                logger.exception("Failed to resume state_goto %s of %s" % (
+                    plan['state'], lf.name))
+            else:
+                resumed.append(lf.get_xpath())
+        return resumed
+
+    def state_goto_resume(self, lifecycle_xpath):
+        """Resume the pending state_goto of matched lifecycles.
+
+        :param lifecyle_xpath: xpath that can match multiple :class:`Lifecycle`
+
+        :rtype: None
+        """
+        for e in XMLRegistery.find_all_elts(lifecycle_xpath):
+            lf_name = XMLRegistery.get_ressource(e, "lifecycle")
+            self.lifecycle_by_name(lf_name).state_goto_resume()
+
     def provide(self, provide_xpath):
         """Return provides that match provide_xpath and that can be reached
         (OS_TYPE).
@@ -1060,6 +1252,48 @@ class LifecycleManager(XMLRessource):
                         acc.append(state.provide_by_name(provide_name))
         return acc
 
+    def provide_index(self):
+        """Return the :py:class:`ProvideIndex` of provides of loaded
+        lifecycles. It is built again when lifecycles are loaded.
+        """
+        key = tuple(sorted(self.lf_loaded))
+        if self._provide_index_key != key:
+            index = ProvideIndex()
+            for lf in self.lf_loaded.values():
+                for state in lf.state_list():
+                    for provide in state.provides:
+                        if provide.get_xpath_relative() is not None:
+                            index.add(lf, state, provide)
+            self._provide_index = index
+            self._provide_index_key = key
+        return self._provide_index
+
+    def provide_search(self, tags=[], text=None, offset=0, limit=None):
+        """Search provides by tags and text. Like :py:meth:`provide`,
+        only provides that can be reached are returned.
+
+        :param tags: provides must have all these tags
+        :type tags: [str]
+        :param text: words of the provide name, label or help must
+            start with all words of text
+        :type text: str
+        :param offset: index of the first provide to return
+        :param limit: maximum number of provides to return
+
+        :return: total number of matching provides and the requested
+            page of provides, sorted by xpath
+        :rtype: (int, [:py:class:`Provide`])
+        """
+        index = self.provide_index()
+        acc = []
+        for xpath in index.search(tags, text):
+            lf, state, provide = index.provides[xpath]
+            if (lf._is_state_in_stack(state) or
+                    lf.provide_call_path(state) != []):
+                acc.append(provide)
+        end = offset + limit if limit is not None else None
+        return (len(acc), acc[offset:end])
+
     def provide_call_requires(self, provide_xpath_uri, path_idx=0):
         """Requires for the provide.
 
@@ -0,0 +1,324 @@
+"""Package databases and parsers of package managers outputs.
+
+Installed packages are read from the package manager database by
+:py:class:`DpkgDatabase` and :py:class:`RpmDatabase`. The database is
+only read again when its file changes, so checking if packages are
+installed doesn't spawn any process.
+
+Repository metadata is refreshed through :py:data:`apt_refresh` and
+:py:data:`urpmi_refresh` so that states deployed on the same host
+don't refresh it several times (see :py:class:`RepositoryRefresh`).
+
+Package managers are run with the C locale (see :py:data:`APT_ENV`) so
+that their messages can be parsed.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+
+from armonic.process import ProcessThread, run
+
+logger = logging.getLogger(__name__)
+
+APT_ENV = {"DEBIAN_FRONTEND": "noninteractive", "LC_ALL": "C"}
+"""Environment of apt-get and dpkg commands."""
+
+_apt_errors = [
+    re.compile(r"^E: Unable to locate package (?P<package>\S+)$"),
+    re.compile(r"^E: Package '(?P<package>[^']+)' has no installation candidate$"),
+    re.compile(r"^E: Version '[^']+' for '(?P<package>[^']+)' was not found$"),
+    re.compile(r"^E: Couldn't find any package by (?:regex|glob) '(?P<package>[^']+)'$"),
+    re.compile(r"^dpkg: error processing (?:package |archive )?(?P<package>\S+)"),
+]
+_unmet_dependency = re.compile(r"^ (?P<package>\S+) : (?P<reason>.*)$")
+_unmet_dependency_next = re.compile(r"^ +(?P<reason>\S.*)$")
+
+
+def _package_name(name):
+    """Remove the architecture of a package name (foo:amd64). Archives
+    (/var/cache/apt/archives/foo_1.0_amd64.deb) are replaced by the
+    package name."""
+    if "/" in name:
+        name = os.path.basename(name).split("_")[0]
+    return name.split(":")[0]
+
+
+def parse_dpkg_status(lines):
+    """Return installed packages of a dpkg status file.
+
+    :param lines: lines of the status file
+    :rtype: {package: version}
+    """
+    installed = {}
+    package = status = version = None
+    for line in lines:
+        if line.startswith("Package: "):
+            package = line[9:].strip()
+        elif line.startswith("Status: "):
+            status = line[8:].split()
+        elif line.startswith("Version: "):
+            version = line[9:].strip()
+        elif not line.strip():
+            # End of a paragraph
+            if package and status and status[-1] == "installed":
+                installed[package] = version
+            package = status = version = None
+    if package and status and status[-1] == "installed":
+        installed[package] = version
+    return installed
+
+
+def parse_rpm_qa(output):
+    """Return packages listed by ``rpm -qa`` with
+    :py:data:`RpmDatabase.query_format`.
+
+    :rtype: {package: version}
+    """
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            installed[fields[0]] = fields[1]
+    return installed
+
+
+class PackageDatabase(object):
+    """Installed packages, read again when :py:attr:`path` changes.
+
+    :param path: the database file
+    """
+    path = None
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self._key = None
+        self._packages = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Read installed packages.
+
+        :rtype: {package: version}
+        """
+        raise NotImplementedError()
+
+    def packages(self):
+        """Return installed packages.
+
+        :rtype: {package: version}
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+                key = (stat.st_mtime, stat.st_size, stat.st_ino)
+            except OSError as e:
+                logger.warning("Can not read package database %s: %s" % (self.path, e))
+                return {}
+            if key != self._key:
+                logger.debug("Reading package database %s" % self.path)
+                self._packages = self._load()
+                self._key = key
+            return self._packages
+
+    def is_installed(self, package):
+        return package in self.packages()
+
+    def installed(self, packages):
+        """Return the installed packages amongst packages.
+
+        :rtype: set of packages
+        """
+        return set(packages) & set(self.packages())
+
+
+class DpkgDatabase(PackageDatabase):
+    path = "/var/lib/dpkg/status"
+
+    def _load(self):
+        with open(self.path) as f:
+            return parse_dpkg_status(f)
+
+
+class QueryThread(ProcessThread):
+    """Keep the whole output of package queries."""
+    output_retention = None
+
+
+class RpmDatabase(PackageDatabase):
+    """The rpm database is read with one ``rpm -qa`` call."""
+    path = "/var/lib/rpm/Packages"
+    query_format = "%{NAME} %{VERSION}-%{RELEASE}\\n"
+
+    def command(self):
+        return ["/bin/rpm", "-qa", "--queryformat", self.query_format]
+
+    def _load(self):
+        query = QueryThread("/bin/rpm", None, "test", self.command())
+        if not query.launch():
+            logger.warning("Can not list installed packages with rpm")
+            return {}
+        return parse_rpm_qa(query.output)
+
+
+dpkg_database = DpkgDatabase()
+rpm_database = RpmDatabase()
+
+
+class _Refresh(object):
+    """A refresh in progress, waited by other requesters."""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.success = False
+        self.event = threading.Event()
+
+
+class RepositoryRefresh(object):
+    """Refresh repository metadata only when it is needed.
+
+    The metadata is refreshed if the repository configuration changed
+    since the last successful refresh or if it is older than
+    :py:attr:`ttl`. Requesters arriving while a refresh is running
+    wait for it instead of starting a new one.
+
+    :param command: the refresh command
+    :param paths: files and directories of the repository
+        configuration
+    :param env: environment of the command
+    :param ttl: time in seconds after which the metadata is refreshed
+        even if the configuration didn't change
+    """
+    def __init__(self, command, paths, env=None, ttl=3600):
+        self.command = command
+        self.paths = paths
+        self.env = env
+        self.ttl = ttl
+        self.refreshed_at = None
+        """Time of the last successful refresh"""
+        self.refreshed_fingerprint = None
+        """Configuration fingerprint of the last successful refresh"""
+        self._inflight = None
+        self._lock = threading.Lock()
+
+    def fingerprint(self):
+        """Return a hash of the repository configuration files."""
+        digest = hashlib.sha1()
+        for path in self.paths:
+            if os.path.isdir(path):
+                files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+            else:
+                files = [path]
+            for f in files:
+                digest.update(f + "\0")
+                try:
+                    with open(f, "rb") as content:
+                        digest.update(content.read())
+                except IOError:
+                    # Missing file or directory
+                    pass
+                digest.update("\0")
+        return digest.hexdigest()
+
+    def is_fresh(self, fingerprint=None):
+        if fingerprint is None:
+            fingerprint = self.fingerprint()
+        return (self.refreshed_at is not None and
+                fingerprint == self.refreshed_fingerprint and
+                time.time() - self.refreshed_at < self.ttl)
+
+    def refresh(self, force=False):
+        """Refresh the metadata if it is needed (or if force is True).
+
+        A refresh which started after the call is shared even if force
+        is True.
+
+        :return: False if the refresh command failed
+        """
+        while True:
+            with self._lock:
+                inflight = self._inflight
+                if inflight is None:
+                    fingerprint = self.fingerprint()
+                    if not force and self.is_fresh(fingerprint):
+                        logger.info("Repository metadata is up to date, skipping `%s`" %
+                                    " ".join(self.command))
+                        return True
+                    inflight = self._inflight = _Refresh(fingerprint)
+                    break
+            logger.info("Waiting for `%s`..." % " ".join(self.command))
+            inflight.event.wait()
+            if inflight.fingerprint == self.fingerprint():
+                return inflight.success
+            # The configuration changed during the refresh
+
+        try:
+            inflight.success = run(self.command[0], self.command[1:], env=self.env)
+            if inflight.success:
+                self.refreshed_at = time.time()
+                self.refreshed_fingerprint = inflight.fingerprint
+            else:
+                logger.warning("`%s` failed" % " ".join(self.command))
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.event.set()
+        return inflight.success
+
+
+apt_refresh = RepositoryRefresh(["/usr/bin/apt-get", "update"],
+                                ["/etc/apt/sources.list",
+                                 "/etc/apt/sources.list.d",
+                                 "/etc/apt/trusted.gpg",
+                                 "/etc/apt/trusted.gpg.d"],
+                                env=APT_ENV)
+urpmi_refresh = RepositoryRefresh(["/usr/sbin/urpmi.update", "-a"],
+                                  ["/etc/urpmi/urpmi.cfg"])
+
+
+def parse_apt_errors(output):
+    """Find why packages failed to be installed or removed in the
+    output of apt-get.
+
+    :return: for each package in error, the list of error messages
+    :rtype: {package: [message]}
+    """
+    errors = {}
+    unmet = None
+    processing = False
+    for line in output.splitlines():
+        line = line.rstrip()
+        if line.startswith("The following packages have unmet dependencies"):
+            unmet = None
+            processing = False
+            continue
+        if line.startswith("Errors were encountered while processing"):
+            processing = True
+            continue
+
+        match = _unmet_dependency.match(line)
+        if match:
+            unmet = _package_name(match.group('package'))
+            errors.setdefault(unmet, []).append(match.group('reason').strip())
+            continue
+        match = _unmet_dependency_next.match(line)
+        if match and unmet is not None:
+            errors[unmet].append(match.group('reason'))
+            continue
+        if match and processing:
+            package = _package_name(match.group('reason'))
+            errors.setdefault(package, []).append("Error while processing the package")
+            continue
+        unmet = None
+        processing = False
+
+        for regex in _apt_errors:
+            match = regex.match(line)
+            if match:
+                package = _package_name(match.group('package'))
+                errors.setdefault(package, []).append(line)
+                break
+    return errors
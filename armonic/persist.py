@@ -1,6 +1,21 @@
-import os
+"""Persistence of the agent state.
+
+States of ressources (lifecycle stacks, provide histories) are stored
+in a single SQLite database (see :py:class:`StateStore`). The whole
+database is loaded at once when the first ressource is registered and
+:py:meth:`Persist.save` only writes ressources whose state changed, in
+one transaction.
+
+Ressources mark themselves dirty when their state changes (see
+:py:meth:`PersistRessource._persist_dirty`). A :py:class:`Checkpointer`
+writes dirty ressources in the background, so that the agent state
+survives a crash. Changes done during the checkpoint interval are
+written together in one transaction (group commit).
+"""
 import json
+import sqlite3
 import logging
+import threading
 
 from armonic.utils import Singleton
 
@@ -8,49 +23,235 @@ from armonic.utils import Singleton
 logger = logging.getLogger(__name__)
 
 
+class StateStore(object):
+    """A key/value store of ressource states backed by SQLite.
+
+    Values are JSON documents. Writes are done in a transaction so
+    that the database always contains a consistent agent state.
+
+    :param path: the database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS ressources "
+                                     "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def load(self):
+        """Return all stored states.
+
+        :rtype: {key: JSON document}
+        """
+        with self._lock:
+            return dict(self._connection.execute("SELECT key, value FROM ressources"))
+
+    def write(self, values={}, deleted=[]):
+        """Store values and delete keys in a single transaction.
+
+        :param values: {key: JSON document}
+        :param deleted: list of keys
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO ressources "
+                                             "(key, value) VALUES (?, ?)",
+                                             values.items())
+                self._connection.executemany("DELETE FROM ressources WHERE key = ?",
+                                             [(key,) for key in deleted])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
 class Persist(object):
     __metaclass__ = Singleton
 
-    def __init__(self, load_state=False, save_state=False, state_path="/tmp/armonic_%s%s_state"):
+    def __init__(self, load_state=False, save_state=False, state_path="/tmp/armonic_state.db"):
         self.load_state = load_state
         self.save_state = save_state
         self.state_path = state_path
         self.ressources = []
+        self._store = None
+        self._stored = {}
+        self._dirty = {}
+        # _lock protects the store, _dirty_lock the dirty ressources so
+        # that state changes don't wait for a write
+        self._lock = threading.RLock()
+        self._dirty_lock = threading.Lock()
+        self.checkpointer = None
         logger.info("Persist configuration: load_state=%s, save_state=%s" % (load_state, save_state))
 
+    @property
+    def store(self):
+        """The :py:class:`StateStore` of :py:attr:`state_path`, opened
+        and loaded on first use."""
+        with self._lock:
+            if self._store is None or self._store.path != self.state_path:
+                if self._store is not None:
+                    self._store.close()
+                logger.debug("Loading agent state from %s..." % self.state_path)
+                self._store = StateStore(self.state_path)
+                self._stored = self._store.load()
+            return self._store
+
+    def stored(self, key):
+        """Return the stored state of a ressource or None."""
+        with self._lock:
+            # Open and load the store if needed
+            self.store
+            value = self._stored.get(key)
+        if value is not None:
+            return json.loads(value)
+        return None
+
     def register(self, ressource):
         if ressource not in self.ressources:
             self.ressources.append(ressource)
             logger.debug("Registered %s for persistance" % ressource)
 
+    def mark_dirty(self, ressource):
+        """Record that the state of ressource changed. It will be
+        written by the next checkpoint."""
+        with self._dirty_lock:
+            self._dirty[ressource._persist_key] = ressource
+        if self.checkpointer is not None:
+            self.checkpointer.notify()
+
+    def checkpoint(self):
+        """Write the states of dirty ressources in one transaction.
+
+        :return: the number of written states
+        """
+        with self._lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, {}
+            if not self.save_state:
+                return 0
+            values = {}
+            for key, ressource in dirty.items():
+                value = json.dumps(ressource._persist_primitive(), sort_keys=True)
+                if self._stored.get(key) != value:
+                    values[key] = value
+            if values:
+                self.store.write(values)
+                self._stored.update(values)
+            return len(values)
+
+    def start_checkpointer(self, interval=1.0):
+        """Write dirty states in the background, at most every
+        interval seconds."""
+        if self.checkpointer is None:
+            self.checkpointer = Checkpointer(self, interval)
+            self.checkpointer.start()
+        return self.checkpointer
+
+    def stop_checkpointer(self):
+        if self.checkpointer is not None:
+            self.checkpointer.stop()
+            self.checkpointer = None
+
     def save(self):
-        for ressource in self.ressources:
-            ressource._persist_save()
+        """Write states which changed since they have been loaded or
+        saved. If save_state is False, states of registered ressources
+        are removed from the store."""
+        self.stop_checkpointer()
+        with self._lock:
+            store = self.store
+            with self._dirty_lock:
+                self._dirty = {}
+            values = {}
+            deleted = []
+            # The last registered ressource of a key replaces the
+            # previous ones
+            ressources = dict((r._persist_key, r) for r in self.ressources)
+            for key, ressource in ressources.items():
+                if self.save_state:
+                    value = json.dumps(ressource._persist_primitive(), sort_keys=True)
+                    if self._stored.get(key) != value:
+                        values[key] = value
+                elif key in self._stored:
+                    deleted.append(key)
+            if values or deleted:
+                logger.debug("Saving %d states, removing %d states..." %
+                             (len(values), len(deleted)))
+                store.write(values, deleted)
+            self._stored.update(values)
+            for key in deleted:
+                del self._stored[key]
+
+
+class Checkpointer(threading.Thread):
+    """Write dirty states of a :py:class:`Persist` in the background.
+
+    The first change wakes up the checkpointer which waits interval
+    seconds before writing, so that all changes done meanwhile are
+    committed together.
+
+    :param persist: the :py:class:`Persist` to checkpoint
+    :param interval: time in seconds between two checkpoints
+    """
+    def __init__(self, persist, interval=1.0):
+        threading.Thread.__init__(self, name="checkpointer")
+        self.daemon = True
+        self.persist = persist
+        self.interval = interval
+        self.checkpoints = 0
+        """Number of transactions done by the checkpointer"""
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        self._dirty.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._dirty.wait()
+            self._dirty.clear()
+            self._stopped.wait(self.interval)
+            self._checkpoint()
+
+    def _checkpoint(self):
+        try:
+            if self.persist.checkpoint():
+                self.checkpoints += 1
+        except Exception:
+            logger.exception("Failed to write the agent state")
+
+    def stop(self):
+        """Stop the checkpointer after a last checkpoint."""
+        self._stopped.set()
+        self._dirty.set()
+        self.join()
 
 
 class PersistRessource(object):
     _persist = False
     """Define if the ressource can be persistant or not"""
+    _persist_registered = False
 
     @property
-    def _persist_file(self):
-        return Persist().state_path % (self._xml_ressource_name(),
-                                       self.get_xpath().replace('/', '_'))
+    def _persist_key(self):
+        return "%s:%s" % (self._xml_ressource_name(), self.get_xpath())
 
     def _persist_register(self):
         if self._persist and (Persist().save_state or Persist().load_state):
             Persist().register(self)
+            self._persist_registered = True
             self._persist_load()
 
-    def _persist_save(self, *args, **kwargs):
-        if Persist().save_state:
-            logger.debug("Saving %s state in %s..." % (self.name, self._persist_file))
-            with open(self._persist_file, 'w') as f:
-                json.dump(self._persist_primitive(), f)
-        elif os.path.exists(self._persist_file):
-            logger.debug("Removing %s state file %s..." % (self.name, self._persist_file))
-            os.unlink(self._persist_file)
-        return True
+    def _persist_dirty(self, sync=False):
+        """Must be called when the state of the ressource changes.
+
+        :param sync: if True, dirty states are written before
+            returning instead of by the next checkpoint
+        """
+        if self._persist_registered and Persist().save_state:
+            Persist().mark_dirty(self)
+            if sync:
+                Persist().checkpoint()
 
     def _persist_primitive(self):
         """Must return a primitive that can be serialized.
@@ -60,13 +261,12 @@ class PersistRessource(object):
         raise NotImplementedError()
 
     def _persist_load(self):
-        if Persist().load_state and os.path.exists(self._persist_file):
-            logger.debug("Loading %s state from %s..." % (self, self._persist_file))
-            with open(self._persist_file) as f:
-                state = json.load(f)
-            return self._persist_load_primitive(state)
-        else:
-            return None
+        if Persist().load_state:
+            state = Persist().stored(self._persist_key)
+            if state is not None:
+                logger.debug("Loading %s state..." % self)
+                return self._persist_load_primitive(state)
+        return None
 
     def _persist_load_primitive(self, state):
         """Restore ressource state from state primitive.
@@ -1,13 +1,97 @@
 import os
+import time
+import uuid
+import Queue
 import select
 import threading
 import logging
+from collections import OrderedDict
 from subprocess import Popen, PIPE, STDOUT
 
+import armonic.common
+from armonic.common import PROCESS_LEVEL
+from armonic.jobs import current_job, job_context
+
 logger = logging.getLogger(__name__)
 
+MAX_OUTPUTS = 100
+"""Number of process outputs kept. When a process is started, the
+output of the oldest one is dropped and its file is removed."""
+
+_outputs = OrderedDict()
+_outputs_lock = threading.Lock()
+
+
+class OutputNotFound(Exception):
+    pass
+
+
+def get_output(output_id):
+    """Return the :py:class:`ProcessThread` whose output id is output_id.
+
+    :raises OutputNotFound: if the output doesn't exist anymore
+    """
+    with _outputs_lock:
+        try:
+            return _outputs[output_id]
+        except KeyError:
+            raise OutputNotFound("Output %s does not exist" % output_id)
+
+
+def outputs():
+    """Return kept process outputs, the oldest first.
+
+    :rtype: [:py:class:`ProcessThread`]
+    """
+    with _outputs_lock:
+        return _outputs.values()
+
+
+def _register_output(thread):
+    with _outputs_lock:
+        _outputs[thread.output_id] = thread
+        while len(_outputs) > MAX_OUTPUTS:
+            output_id, old = _outputs.popitem(last=False)
+            old._remove_output_file()
+
+
+class RingBuffer(object):
+    """Keep the last size bytes of a stream, or the whole stream if
+    size is None.
+
+    :py:attr:`start` is the offset in the stream of the first kept byte
+    and :py:attr:`end` the size of the stream.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray()
+        self.start = 0
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def append(self, data):
+        self.data.extend(data)
+        if self.size is None:
+            return
+        overflow = len(self.data) - self.size
+        if overflow > 0:
+            del self.data[:overflow]
+            self.start += overflow
 
-def run(executable, args=[], cwd=None, env=None):
+    def read(self, offset, size):
+        """Return the data at offset. If offset is not kept anymore,
+        data are read from :py:attr:`start`.
+
+        :rtype: (offset, data)
+        """
+        offset = max(offset, self.start)
+        begin = offset - self.start
+        return (offset, str(self.data[begin:begin + size]))
+
+
+def run(executable, args=[], cwd=None, env=None, timeout=None):
     """Launch a executable and wait it. Return True if command succeed
     (ie. if executable return 0).
 
@@ -16,15 +100,165 @@ def run(executable, args=[], cwd=None, env=None):
     :param cwd: The working directory
     :param env: A optionnal dict containing environnement variable
                 name and its value
+    :param timeout: time in seconds after which the process is
+                    terminated (and killed if it doesn't exit)
 
     """
     thread = ProcessThread("None", None, "None",
                            [executable] + args, cwd=cwd, env=env)
-    return thread.launch()
+    if timeout is None:
+        return thread.launch()
+    thread.start()
+    if not thread.wait(timeout):
+        return False
+    return thread.code == 0
+
+
+def run_many(commands, cwd=None, env=None, timeout=None):
+    """Launch independent commands in parallel with the default
+    :py:class:`ProcessExecutor` and wait for all of them.
+
+    :param commands: list of commands, a command being a list
+                     containing the executable and its arguments
+    :param timeout: timeout of each command (see :py:func:`run`)
+    :return: the finished processes, in the order of commands
+    :rtype: [:py:class:`ProcessThread`]
+    """
+    futures = [get_executor().submit(command, cwd=cwd, env=env, timeout=timeout)
+               for command in commands]
+    return [future.wait() for future in futures]
+
+
+class ProcessTimeout(Exception):
+    pass
+
+
+class ProcessFuture(object):
+    """A command submitted to a :py:class:`ProcessExecutor`."""
+
+    def __init__(self, thread, timeout=None):
+        self.thread = thread
+        self.timeout = timeout
+        self.timed_out = False
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Cancel the command. If it is running, the process is
+        terminated."""
+        self.cancelled = True
+        if self.thread.isAlive():
+            self.thread.terminate()
+
+    def wait(self, timeout=None):
+        """Wait until the command is finished.
+
+        :rtype: :py:class:`ProcessThread`
+        """
+        self._done.wait(timeout)
+        return self.thread
+
+    def result(self, timeout=None):
+        """Wait until the command is finished and return True if it
+        succeeded.
+
+        :raises ProcessTimeout: if the process has been terminated
+            because it took more than its timeout
+        """
+        self.wait(timeout)
+        if self.timed_out:
+            raise ProcessTimeout("`%s` didn't finish after %s seconds" % (
+                " ".join(self.thread.command), self.timeout))
+        return self.thread.code == 0
+
+    def _run(self):
+        try:
+            if self.cancelled:
+                return
+            with job_context(self.thread.job):
+                self.thread.start()
+                if not self.thread.wait(self.timeout):
+                    self.timed_out = True
+        finally:
+            self._done.set()
+
+
+class ProcessExecutor(object):
+    """Run commands in a pool of at most max_workers threads.
+
+    :param max_workers: number of commands run at the same time
+    :param timeout: default timeout of commands in seconds
+    """
+    def __init__(self, max_workers=4, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, command, cwd=None, env=None, timeout=None):
+        """Schedule a command.
+
+        :param command: list containing the executable and its
+                        arguments
+        :rtype: :py:class:`ProcessFuture`
+        """
+        thread = ProcessThread(command[0], None, "None", command,
+                               cwd=cwd, env=env)
+        future = ProcessFuture(thread, timeout if timeout is not None else self.timeout)
+        with self._lock:
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work,
+                                          name="process-%d" % len(self._workers))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        self._queue.put(future)
+        return future
+
+    def _work(self):
+        while True:
+            future = self._queue.get()
+            future._run()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the :py:class:`ProcessExecutor` shared by states."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessExecutor()
+        return _executor
 
 
 class ProcessThread(threading.Thread):
-    """ Base class for running tasks """
+    """ Base class for running tasks
+
+    The output of the process is read by chunks of at most
+    :py:attr:`read_size` bytes and logged line by line at the PROCESS
+    level.
+
+    Only the end of the output is kept in memory (see
+    :py:attr:`output_retention`): :py:attr:`output` and the callback
+    only get this part of the output.
+    """
+
+    read_size = 64 * 1024
+    """Maximum number of bytes read at once from the process output."""
+
+    output_retention = 64 * 1024
+    """Number of bytes at the end of the output which are kept in
+    memory. The full output is written in a file in
+    :py:data:`armonic.common.PROCESS_OUTPUT_DIR` and can be read with
+    :py:meth:`read_output`. If None, the whole output is kept in
+    memory."""
 
     def __init__(self,
                  type,
@@ -37,7 +271,14 @@ class ProcessThread(threading.Thread):
                  env=None):
         self.process = None
         self._code = 2000
-        self._output = ""
+        self._output = RingBuffer(self.output_retention)
+        self._line = bytearray()
+        self.output_id = uuid.uuid4().hex
+        self.output_path = None
+        self._output_file = None
+        self._output_dropped = False
+        self.started = None
+        self.finished = None
         self.lock = threading.RLock()
         # thread type (config, install...)
         self.type = type
@@ -50,6 +291,8 @@ class ProcessThread(threading.Thread):
         self.env = os.environ.copy()
         if env:
             self.env.update(env)
+        # Logs of the process belong to the job which creates it
+        self.job = current_job()
         threading.Thread.__init__(self)
 
     def __enter__(self):
@@ -75,23 +318,116 @@ class ProcessThread(threading.Thread):
 
     @property
     def output(self):
+        """The last :py:attr:`output_retention` bytes of the output."""
+        with self.lock:
+            output = str(self._output.data)
         try:
-            return self._output.decode('utf-8')
+            return output.decode('utf-8')
         except:
-            return self._output.decode('latin-1')
+            return output.decode('latin-1')
 
     @property
     def code(self):
         return self._code
 
+    def _open_output_file(self):
+        output_dir = armonic.common.PROCESS_OUTPUT_DIR
+        if output_dir is None:
+            return
+        try:
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            self.output_path = os.path.join(output_dir, "%s.log" % self.output_id)
+            self._output_file = open(self.output_path, 'wb')
+        except (OSError, IOError) as e:
+            logger.warning("Can not write process output in %s: %s" % (output_dir, e))
+            self.output_path = None
+
+    def _remove_output_file(self):
+        """Remove the output file, once the process is finished."""
+        with self.lock:
+            self._output_dropped = True
+            if self.output_path is None or self._output_file is not None:
+                return
+            try:
+                os.remove(self.output_path)
+            except OSError:
+                pass
+            self.output_path = None
+
+    def read_output(self, offset=0, size=64 * 1024):
+        """Read at most size bytes of the output from offset. If the
+        output is not written in a file, only the last
+        :py:attr:`output_retention` bytes can be read.
+
+        :rtype: (offset, data) where offset is the offset of data in the
+            output
+        """
+        with self.lock:
+            if self.output_path is None:
+                return self._output.read(offset, size)
+            if self._output_file is not None:
+                self._output_file.flush()
+            with open(self.output_path, 'rb') as f:
+                f.seek(offset)
+                return (offset, f.read(size))
+
+    @property
+    def output_size(self):
+        return self._output.end
+
+    def to_primitive(self):
+        return {"id": self.output_id,
+                "command": self.command,
+                "code": None if self.finished is None else self._code,
+                "size": self.output_size,
+                "started": self.started,
+                "finished": self.finished}
+
     def run(self):
         """ run command """
+        with job_context(self.job):
+            self._run()
+
+    def _run(self):
         logger.debug("Running `%s` command" % " ".join(self.command))
+        self.started = time.time()
+        self._open_output_file()
+        _register_output(self)
         self.process = Popen(self.command, stdout=PIPE, stderr=STDOUT,
             bufsize=1, cwd=self.cwd, shell=self.shell, env=self.env)
         self.catch_output()
         return 0
 
+    def wait(self, timeout=None, kill_delay=5):
+        """Wait until the process is finished. After timeout seconds,
+        the process is terminated.
+
+        :return: False if the process has been terminated
+        """
+        self.join(timeout)
+        if not self.isAlive():
+            return True
+        logger.warning("`%s` didn't finish after %s seconds, terminating it" % (
+            " ".join(self.command), timeout))
+        self.terminate(kill_delay)
+        return False
+
+    def terminate(self, kill_delay=5):
+        """Terminate the process and kill it if it is still running
+        after kill_delay seconds."""
+        try:
+            self.process.terminate()
+            self.join(kill_delay)
+            if self.isAlive():
+                logger.warning("Killing `%s`" % " ".join(self.command))
+                self.process.kill()
+                self.join()
+        except OSError:
+            pass
+        except AttributeError:
+            pass
+
     def stop(self):
         """ stop current process if exists"""
         try:
@@ -102,44 +438,49 @@ class ProcessThread(threading.Thread):
         except AttributeError:
             pass
 
+    def _log_lines(self, data):
+        """Log complete lines of data. The last incomplete line is kept
+        until the next call."""
+        self._line.extend(data)
+        end = self._line.rfind("\n")
+        if end == -1:
+            return
+        for line in str(self._line[:end]).split("\n"):
+            logger.log(PROCESS_LEVEL, line)
+        del self._line[:end + 1]
+
     def catch_output(self):
         """ get command context """
-        while self.isAlive():
-            # get the file descriptor of the process stdout pipe
-            # for reading
-            try:
-                fd = select.select([self.process.stdout.fileno()],
-                    [], [], 5)[0][0]
-            # raise an exception when the process doesn't make output
-            # for long time
-            except IndexError:
-                fd = None
-                pass
-
-            self.process.poll()
-            if self.process.returncode == None:
-                # get bytes one by one
-                if fd:
-                    self.lock.acquire()
-                    self._output += os.read(fd, 1)
-                    if self._output != "":
-                        logger.process(self._output[-1])
-                    self.lock.release()
-            else:
-                # get last bytes from output
-                if fd:
-                    self.lock.acquire()
-                    while True:
-                        output = os.read(fd, 4096)
-                        if output == None or output == "":
-                            break
-                        logger.process(output)
-                        self._output += output
-                    self.lock.release()
-                self._code = self.process.returncode
-                if self.callback:
-                    self.callback(self.module, self._code, self._output)
-                logger.process("Finished `%s` command\n" %
-                               " ".join(self.command))
-                logger.debug("Finished `%s` command" % " ".join(self.command))
+        fd = self.process.stdout.fileno()
+        while True:
+            # Once the process is finished, only read what is already
+            # available since the pipe can be kept open by its children
+            finished = self.process.poll() is not None
+            if not select.select([fd], [], [], 0 if finished else 1)[0]:
+                if finished:
+                    break
+                continue
+            # read what is available, at most read_size bytes
+            data = os.read(fd, self.read_size)
+            if not data:
                 break
+            with self.lock:
+                self._output.append(data)
+                if self._output_file is not None:
+                    self._output_file.write(data)
+            self._log_lines(data)
+        if self._line:
+            logger.log(PROCESS_LEVEL, str(self._line))
+            del self._line[:]
+        self._code = self.process.wait()
+        with self.lock:
+            if self._output_file is not None:
+                self._output_file.close()
+                self._output_file = None
+                if self._output_dropped:
+                    self._remove_output_file()
+            self.finished = time.time()
+        if self.callback:
+            self.callback(self.module, self._code, str(self._output.data))
+        logger.log(PROCESS_LEVEL, "Finished `%s` command" % " ".join(self.command))
+        logger.debug("Finished `%s` command" % " ".join(self.command))
@@ -0,0 +1,238 @@
+"""Wire protocol shared by the socket agent and
+:py:class:`armonic.client.sock.ClientSocket`.
+
+Each message is sent in a frame::
+
+    +--------------+-------------+-------------+---------------------+
+    | size (int32) | flags (int8)| codec (int8)| payload (size bytes)|
+    +--------------+-------------+-------------+---------------------+
+
+The payload is encoded by the codec identified in the header. A frame
+is then self-describing and the agent always answers with the codec
+used by the request. If the flag :py:data:`FLAG_COMPRESSED` is set,
+the payload has been compressed with zlib after being encoded.
+
+The client sends one frame containing the request::
+
+    {'method': name, 'args': [...], 'kwargs': {...}, 'log_level': level,
+     'compress': bool, 'if_generation': generation}
+
+where log_level is the minimum level of log records the client wants
+to receive and compress is True if the client accepts compressed
+frames. The agent always accepts compressed requests. if_generation
+is optional (see :py:meth:`armonic.serialize.Serialize._dispatch`).
+
+The agent sends several frames containing a list of log records and a
+last frame (flag :py:data:`FLAG_LAST` set) containing::
+
+    {'return': value, 'generation': generation} |
+    {'not_modified': True, 'generation': generation} |
+    {'exception': {'code': name, 'message': msg}}
+
+Log records are not sent as objects but as a small fixed schema (see
+:py:func:`log_record_to_primitive`).
+"""
+import json
+import zlib
+import struct
+import logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!IBB")
+"""Frame header: payload size, flags and codec id."""
+
+FLAG_LAST = 0x01
+"""Set on the last frame of a response."""
+
+FLAG_COMPRESSED = 0x02
+"""Set if the payload is compressed with zlib."""
+
+COMPRESSION_THRESHOLD = 8 * 1024
+"""Payloads smaller than this size (in bytes) are never compressed."""
+
+COMPRESSION_LEVEL = 6
+"""The zlib compression level."""
+
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+"""Frames bigger than this size are refused."""
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Codec(object):
+    """Base class of payload codecs. To add a codec, subclass it, set
+    a unique :py:attr:`id` and :py:attr:`name` and register it with
+    :py:func:`register_codec`."""
+    id = None
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError()
+
+    def loads(self, data):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "<Codec:%s>" % self.name
+
+
+class JSONCodec(Codec):
+    id = 1
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """Only available if the msgpack module is installed."""
+    id = 2
+    name = "msgpack"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    _codecs[codec.id] = codec
+    _codecs[codec.name] = codec
+
+
+def get_codec(codec):
+    """Return the codec identified by its name or its id.
+
+    :raises ProtocolError: if the codec is unknown
+    """
+    try:
+        return _codecs[codec]
+    except KeyError:
+        raise ProtocolError("Codec '%s' is not supported" % codec)
+
+
+def codec_names():
+    return sorted(c.name for c in set(_codecs.values()))
+
+register_codec(JSONCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+DEFAULT_CODEC = "json"
+
+
+def compress(data, threshold=COMPRESSION_THRESHOLD):
+    """Compress data if it is bigger than threshold and if compression
+    saves space.
+
+    :rtype: (data, is_compressed)
+    """
+    if len(data) < threshold:
+        return (data, False)
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    if len(compressed) >= len(data):
+        return (data, False)
+    return (compressed, True)
+
+
+def decompress(data, max_size=MAX_FRAME_SIZE):
+    decompressor = zlib.decompressobj()
+    try:
+        ret = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ProtocolError("Can not decompress payload: %s" % e)
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("Decompressed payload too big (more than %d bytes)" % max_size)
+    return ret
+
+
+def send_frame(socket, obj, codec, last=False, compression=False):
+    """Encode obj with codec and send it in a single frame.
+
+    :param compression: if True, the payload is compressed when it is
+        big enough (see :py:func:`compress`)
+    """
+    payload = codec.dumps(obj)
+    flags = FLAG_LAST if last else 0
+    if compression:
+        payload, compressed = compress(payload)
+        if compressed:
+            flags |= FLAG_COMPRESSED
+    socket.sendall(FRAME_HEADER.pack(len(payload), flags, codec.id) + payload)
+
+
+def _recv_exactly(socket, size):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = socket.recv(min(remaining, 65536))
+        if not data:
+            raise ProtocolError("Connection closed by peer")
+        chunks.append(data)
+        remaining -= len(data)
+    return "".join(chunks)
+
+
+def recv_frame(socket):
+    """Receive a frame.
+
+    :rtype: (last, codec, obj)
+    """
+    header = _recv_exactly(socket, FRAME_HEADER.size)
+    size, flags, codec_id = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError("Frame too big (%d bytes)" % size)
+    payload = _recv_exactly(socket, size)
+    if flags & FLAG_COMPRESSED:
+        payload = decompress(payload)
+    codec = get_codec(codec_id)
+    return (bool(flags & FLAG_LAST), codec, codec.loads(payload))
+
+
+def exception_to_primitive(exception):
+    return {'code': exception.__class__.__name__,
+            'message': str(exception)}
+
+
+# Position of fields in a serialized log record
+LOG_RECORD_FIELDS = ('created', 'levelno', 'name', 'module', 'msg', 'ip', 'xpath')
+
+NO_LOG_LEVEL = logging.CRITICAL + 10
+"""Log level to use when no log has to be sent."""
+
+
+def log_record_to_primitive(record):
+    """Serialize a LogRecord to a list whose fields are described by
+    :py:data:`LOG_RECORD_FIELDS`. The message is formatted with record
+    args."""
+    return [record.created,
+            record.levelno,
+            record.name,
+            record.module,
+            record.getMessage(),
+            getattr(record, 'ip', ""),
+            getattr(record, 'xpath', "")]
+
+
+def log_record_from_primitive(primitive):
+    """Build back a LogRecord from :py:func:`log_record_to_primitive`
+    output."""
+    dct = dict(zip(LOG_RECORD_FIELDS, primitive))
+    dct['levelname'] = logging.getLevelName(dct['levelno'])
+    return logging.makeLogRecord(dct)
@@ -1,8 +1,10 @@
+import json
+import hashlib
 import logging
 import itertools
 from time import time
 
-from armonic.utils import IterContainer, DoesNotExist
+from armonic.utils import IterContainer, DoesNotExist, Generation
 from armonic.common import ValidationError, ExtraInfoMixin
 from armonic.xml_register import XMLRegistery, XMLRessource
 
@@ -112,6 +114,7 @@ class Provide(IterContainer, XMLRessource, ExtraInfoMixin):
             self.source = requires[1]
         except IndexError:
             self.source = None
+        Generation().bump()
 
     def validate(self):
         """Validate the provide.
@@ -161,6 +164,15 @@ class Provide(IterContainer, XMLRessource, ExtraInfoMixin):
             source = {}
         return [list(itertools.chain(*[r.get_values() for r in self])), source]
 
+    def fingerprint(self):
+        """Return a hash of the variable values of the requires. The
+        caller (source) is not part of the fingerprint.
+
+        :rtype: str
+        """
+        values = self.get_values()[0]
+        return hashlib.sha1(json.dumps(values, sort_keys=True, default=str)).hexdigest()
+
     def _clear(self):
         """Reset variables to default values in all reauires.
         """
@@ -169,9 +181,12 @@ class Provide(IterContainer, XMLRessource, ExtraInfoMixin):
 
     def finalize(self):
         # record call
-        self.history.add_entry(requires=self.get_values())
+        self.history.add_entry(requires=self.get_values(),
+                               fingerprint=self.fingerprint())
         # clear provide
         self._clear()
+        Generation().bump()
+        self._persist_dirty()
 
     def __repr__(self):
         return "<Provide:%s(%s,flags=%s)>" % (self.name,
@@ -193,12 +208,13 @@ class ProvideHistory(object):
     """Record provide calls.
     """
 
-    def __init__(self, initial_history=[]):
-        self._history = initial_history
+    def __init__(self, initial_history=None):
+        self._history = initial_history if initial_history is not None else []
 
-    def add_entry(self, requires=[]):
+    def add_entry(self, requires=[], fingerprint=None):
         self._history.append({'timestamp': int(time()),
-                              'requires': requires})
+                              'requires': requires,
+                              'fingerprint': fingerprint})
 
     def to_primitive(self):
         return self._history
@@ -1,8 +1,13 @@
 import json
+import threading
 from functools import wraps
 
 from armonic import LifecycleManager
-from armonic.common import expose, is_exposed
+from armonic.common import expose, is_exposed, conditional, is_conditional, \
+    mutating, is_mutating
+from armonic.utils import Generation
+from armonic.jobs import JobTable, JobNotFinished, JobCancelled, DONE, CANCELLED
+import armonic.process
 
 
 class MethodNotExposed(Exception):
@@ -14,9 +19,53 @@ class MethodNotExposed(Exception):
         return repr(self.value)
 
 
+class NotModified(Exception):
+    """Raised when a conditional method is called with the current
+    generation."""
+
+    def __init__(self, generation):
+        self.generation = generation
+
+    def __str__(self):
+        return "Not modified since generation %s" % self.generation
+
+
+def _utf8_boundaries(data):
+    """Return the offsets of the first and of the last UTF-8 character
+    boundaries of data. Bytes of characters which are not complete in
+    data are left out, unless data only contains such bytes."""
+    begin = 0
+    # Continuation bytes of a character started before data
+    while begin < min(3, len(data)) and ord(data[begin]) & 0xC0 == 0x80:
+        begin += 1
+    end = len(data)
+    # Look for the lead byte of the last character
+    for i in range(len(data) - 1, max(begin, len(data) - 4) - 1, -1):
+        byte = ord(data[i])
+        if byte & 0xC0 == 0x80:
+            continue
+        if byte >= 0xF0:
+            length = 4
+        elif byte >= 0xE0:
+            length = 3
+        elif byte >= 0xC0:
+            length = 2
+        else:
+            length = 1
+        if i + length > len(data):
+            end = i
+        break
+    if end <= begin:
+        return 0, len(data)
+    return begin, end
+
+
 class Serialize(object):
     def __init__(self, *args, **kwargs):
         self.lf_manager = LifecycleManager(*args, **kwargs)
+        # Mutating calls and jobs are not run concurrently
+        self.lock = threading.Lock()
+        self.jobs = JobTable(lock=self.lock)
 
     def __enter__(self):
         return self
@@ -24,21 +73,42 @@ class Serialize(object):
     def __exit__(self, type, value, traceback):
         self.lf_manager.close()
 
+    @property
+    def generation(self):
+        """The current generation of the agent. Agents have to send it
+        with each response."""
+        return Generation().value
+
     def _dispatch(self, method, *args, **kwargs):
         """Method used by the agent to query :py:class:`LifecycleManager`
         methods.
         Only exposed methods are available through the agent.
+
+        If the method is conditional and the keyword argument
+        if_generation is the current generation, the method is not
+        called and :py:class:`NotModified` is raised.
+
+        Mutating methods wait for the running job to finish.
         """
+        if_generation = kwargs.pop('if_generation', None)
         func = getattr(self, method)
         if not is_exposed(func):
             raise MethodNotExposed('Method "%s" is not supported' % method)
+        if (if_generation is not None and is_conditional(func)
+                and if_generation == self.generation):
+            raise NotModified(if_generation)
+        if is_mutating(func):
+            with self.lock:
+                return func(*args, **kwargs)
         return func(*args, **kwargs)
 
     @expose
+    @conditional
     def info(self):
         return self.lf_manager.info()
 
     @expose
+    @conditional
     def lifecycle(self, xpath, long_description=False):
         """If long_description is True, return a dict.
         Otherwise, return lifecycles xpath."""
@@ -50,6 +120,7 @@ class Serialize(object):
         return [l.get_xpath() for l in lfs]
 
     @expose
+    @conditional
     def state(self, xpath, doc=False):
         states = self.lf_manager.state(xpath)
         if doc:
@@ -58,12 +129,14 @@ class Serialize(object):
             return [s.get_xpath() for s in states]
 
     @expose
+    @conditional
     def state_current(self, xpath):
         states = self.lf_manager.state_current(xpath)
         return [{"xpath": s.get_xpath(), "state": s.name}
                 for s in states]
 
     @expose
+    @conditional
     def state_goto_path(self, state_xpath):
         ret = self.lf_manager.state_goto_path(state_xpath)
         acc = []
@@ -74,15 +147,44 @@ class Serialize(object):
         return acc
 
     @expose
+    @conditional
     def state_goto_requires(self, xpath):
         provides = self.lf_manager.state_goto_requires(xpath)
         return {'xpath': xpath, 'requires': [p.to_primitive() for p in provides]}
 
     @expose
+    @mutating
     def state_goto(self, xpath, requires={}):
         return self.lf_manager.state_goto(xpath, requires)
 
     @expose
+    def state_goto_plans(self):
+        """Return state_goto which have not been completed because
+        they failed or because the agent stopped. They are resumed
+        with :py:meth:`state_goto_resume`. Interrupted ones are also
+        resumed when the agent starts with --resume-plans.
+
+        :rtype: [{'xpath': lifecycle_xpath, 'state': state_name,
+            'path': [(state_name, method)], 'done': int,
+            'started': timestamp, 'error': str}]
+        """
+        acc = []
+        for lf, plan in self.lf_manager.state_goto_plans():
+            acc.append({'xpath': lf.get_xpath(),
+                        'state': plan['state'],
+                        'path': plan['path'],
+                        'done': plan['done'],
+                        'started': plan['started'],
+                        'error': plan['error']})
+        return acc
+
+    @expose
+    @mutating
+    def state_goto_resume(self, xpath):
+        return self.lf_manager.state_goto_resume(xpath)
+
+    @expose
+    @conditional
     def provide(self, provide_xpath):
         """Return provides that match provide_xpath.
 
@@ -91,6 +193,24 @@ class Serialize(object):
         return [p.to_primitive() for p in self.lf_manager.provide(provide_xpath)]
 
     @expose
+    @conditional
+    def provide_search(self, tags=[], text=None, primitive=False, offset=0, limit=50):
+        """Search provides by tags and text (see
+        :py:meth:`armonic.lifecycle.LifecycleManager.provide_search`).
+
+        :param primitive: if True, return provide primitives instead of
+            xpaths
+        :rtype: {'total': int, 'provides': [xpath] | [Provide_primitive]}
+        """
+        total, provides = self.lf_manager.provide_search(tags, text, offset, limit)
+        if primitive:
+            provides = [p.to_primitive() for p in provides]
+        else:
+            provides = [p.get_xpath_relative() for p in provides]
+        return {'total': total, 'provides': provides}
+
+    @expose
+    @conditional
     def provide_call_path(self, provide_xpath):
         """Paths for provides that match provide_xpath
         """
@@ -104,6 +224,7 @@ class Serialize(object):
         return acc
 
     @expose
+    @conditional
     def provide_call_requires(self, provide_xpath_uri, path_idx=0):
         """Return Provide required to go to the provide state AND the provide.
 
@@ -126,24 +247,100 @@ class Serialize(object):
         return result
 
     @expose
+    @mutating
     def provide_call(self, provide_xpath_uri, requires=[], path_idx=0):
         return self.lf_manager.provide_call(provide_xpath_uri, requires, path_idx)
 
     @expose
+    def provide_call_async(self, provide_xpath_uri, requires=[], path_idx=0):
+        """Same as :py:meth:`provide_call` but the call is done in
+        background.
+
+        :return: the job id to use with :py:meth:`job_status`,
+            :py:meth:`job_result` and :py:meth:`job_cancel`
+        """
+        return self.jobs.submit("provide_call %s" % provide_xpath_uri,
+                                self.lf_manager.provide_call,
+                                provide_xpath_uri, requires, path_idx).id
+
+    @expose
+    def job_status(self, job_id, log_offset=None):
+        """Return the status of a job. If log_offset is not None, log
+        records emitted by the job from log_offset are returned in
+        logs (see :py:func:`armonic.protocol.log_record_to_primitive`).
+        """
+        return self.jobs.get(job_id).to_primitive(log_offset)
+
+    @expose
+    def job_result(self, job_id):
+        """Return the result of a job. If the job failed, its exception
+        is raised.
+
+        :raises JobNotFinished: if the job is not finished
+        :raises JobCancelled: if the job has been cancelled
+        """
+        job = self.jobs.get(job_id)
+        if job.status == DONE:
+            return job.result
+        if job.status == CANCELLED:
+            raise JobCancelled("Job %s has been cancelled" % job_id)
+        if job.exception is not None:
+            raise job.exception
+        raise JobNotFinished("Job %s is %s" % (job_id, job.status))
+
+    @expose
+    def job_cancel(self, job_id):
+        return self.jobs.cancel(job_id).to_primitive()
+
+    @expose
+    def process_outputs(self):
+        """Return processes whose output is kept, the oldest first.
+
+        :rtype: [{'id', 'command', 'code', 'size', 'started', 'finished'}]
+        """
+        return [p.to_primitive() for p in armonic.process.outputs()]
+
+    @expose
+    def process_output(self, output_id, offset=0, size=64 * 1024):
+        """Read at most size bytes of a process output from offset.
+
+        Offsets and sizes are in bytes. The returned offset can be
+        greater than the asked one if the beginning of the output is
+        not kept anymore. The chunk is cut on UTF-8 character
+        boundaries, so it can be shorter than size: the next chunk has
+        to be read from next_offset.
+
+        :rtype: {'id', 'offset', 'next_offset', 'data', 'size', 'finished'}
+        """
+        process = armonic.process.get_output(output_id)
+        offset, data = process.read_output(offset, size)
+        begin, end = _utf8_boundaries(data)
+        return {'id': output_id,
+                'offset': offset + begin,
+                'next_offset': offset + end,
+                'data': data[begin:end].decode('utf-8', 'replace'),
+                'size': process.output_size,
+                'finished': process.finished is not None}
+
+    @expose
+    @conditional
     def to_dot(self, lf_name, reachable=False):
         return self.lf_manager.to_dot(lf_name, reachable)
 
     @expose
+    @conditional
     def uri(self, xpath="//", relative=False, resource=None):
         return self.lf_manager.uri(xpath,
                                    relative=relative,
                                    resource=resource)
 
     @expose
+    @conditional
     def xpath(self, xpath):
         return self.lf_manager.xpath(xpath)
 
     @expose
+    @conditional
     def to_xml(self, xpath=None):
         """Return the xml representation of agent."""
         return self.lf_manager.to_xml(xpath)
@@ -2,7 +2,7 @@ import logging
 
 from armonic.lifecycle import State
 from armonic.provide import Provide
-from armonic.process import ProcessThread
+from armonic.process import get_executor, run_many
 import armonic.utils
 
 
@@ -13,6 +13,10 @@ class ErrorSystemd(Exception):
     pass
 
 
+class ErrorSystemV(Exception):
+    pass
+
+
 class ActiveWithSystemd(State):
     """Start services using ``systemd``.
     """
@@ -22,29 +26,42 @@ class ActiveWithSystemd(State):
     """Human name of the service to start"""
     supported_os_type = [armonic.utils.OsTypeMBS()]
     """Supported OS list for this state"""
+    timeout = 300
+    """Time in seconds after which a systemctl command is terminated"""
+
+    def __units(self):
+        return ["%s.service" % service for service in self.services]
 
     def __systemctl(self, action):
-        for service in self.services:
-            logger.info("systemctl %s %s.service ..." % (action, service))
-            thread = ProcessThread("systemctl %s %s.service" % (action, service),
-                                   None,
-                                   "test",
-                                   ["/bin/systemctl", action, "%s.service" % service])
-            thread.start()
-            thread.join()
-            if thread.code == 0:
-                logger.info("systemctl %s %s.service: done." %
-                            (action, service))
-            else:
-                logger.info("systemctl %s %s.service: failed!" %
-                            (action, service))
-                thread = ProcessThread("systemctl status %s.service" % service,
-                                       None,
-                                       "test",
-                                       ["/bin/systemctl", "status", "%s.service" % service])
-                thread.start()
-                thread.join()
-                raise ErrorSystemd("See PROCESS log for information about systemd status %s" % service)
+        """Apply action on all services with a single systemctl call."""
+        if not self.services:
+            return
+        units = " ".join(self.__units())
+        logger.info("systemctl %s %s ..." % (action, units))
+        future = get_executor().submit(["/bin/systemctl", action] + self.__units(),
+                                       timeout=self.timeout)
+        if future.wait().code == 0 and not future.timed_out:
+            logger.info("systemctl %s %s: done." % (action, units))
+            return
+        logger.info("systemctl %s %s: failed!" % (action, units))
+        failed = self.__failed_services(action)
+        # Log the status of failed services in the PROCESS log
+        get_executor().submit(["/bin/systemctl", "status", "--no-pager"] +
+                              ["%s.service" % s for s in failed],
+                              timeout=self.timeout).wait()
+        raise ErrorSystemd("See PROCESS log for information about systemd status %s" %
+                           ", ".join(failed))
+
+    def __failed_services(self, action):
+        """Return services which are not in the state expected after
+        action, with a single status query."""
+        query = get_executor().submit(["/bin/systemctl", "is-active"] + self.__units(),
+                                      timeout=self.timeout).wait()
+        states = query.output.split()
+        if len(states) != len(self.services):
+            return self.services
+        return [service for service, state in zip(self.services, states)
+                if (state == "active") == (action == "stop")]
 
     def enter(self):
         logger.info("Starting services '%s' ..." % self.services)
@@ -75,27 +92,36 @@ class ActiveWithSystemV(State):
     """Human name of the service to start"""
     supported_os_type = [armonic.utils.OsTypeDebian()]
     """Supported OS list for this state"""
+    timeout = 300
+    """Time in seconds after which an init script is terminated"""
 
     def enter(self):
-        for service in self.services:
-            thread = ProcessThread("/etc/init.d/%s" % service,
-                                   None,
-                                   "test",
-                                   ["/etc/init.d/%s" % service, "status"])
-            thread.start()
-            thread.join()
-            if thread.code != 0:
+        # Init scripts of services are independent: run them in parallel
+        statuses = run_many([["/etc/init.d/%s" % service, "status"]
+                             for service in self.services],
+                            timeout=self.timeout)
+        stopped = []
+        for service, status in zip(self.services, statuses):
+            if status.code != 0:
                 logger.info("%s.%s /etc/init.d/%s start..." %
                             (self.lf_name, self.name, service))
-                thread = ProcessThread("/etc/init.d/%s" % service,
-                                       None,
-                                       "test",
-                                       ["/etc/init.d/%s" % service, "start"])
-                thread.start()
-                thread.join()
+                stopped.append(service)
             else:
                 logger.info("%s.%s service %s is already started ..." %
                             (self.lf_name, self.name, service))
+        starts = run_many([["/etc/init.d/%s" % service, "start"]
+                           for service in stopped],
+                          timeout=self.timeout)
+        failed = []
+        for service, start in zip(stopped, starts):
+            if start.code != 0:
+                logger.error("%s.%s /etc/init.d/%s start failed (code %s):\n%s" %
+                             (self.lf_name, self.name, service, start.code,
+                              start.output))
+                failed.append(service)
+        if failed:
+            raise ErrorSystemV("Failed to start services %s" % ", ".join(failed))
+        for service in self.services:
             logger.event("%s.%s /etc/init.d/%s start done" %
                          (self.lf_name, self.name, service))
 
@@ -3,7 +3,9 @@ import logging
 from armonic.lifecycle import State, MetaState
 from armonic import process
 import armonic.utils
-from armonic.process import run
+from armonic.process import run, ProcessThread
+from armonic.packages import APT_ENV, parse_apt_errors, dpkg_database, \
+    rpm_database, apt_refresh, urpmi_refresh
 from armonic.configuration_augeas import Configuration, Nodes, Node, Child
 from armonic.require import Require
 from armonic.variable import VString
@@ -37,15 +39,11 @@ class InstallPackagesUrpm(State):
     def enter(self):
         pkgs = " ".join(self.packages)
         logger.info("Updating repositories...")
-        run("/usr/sbin/urpmi.update", ["-a"])
+        urpmi_refresh.refresh()
         logger.info("Installing packages '%s' ..." % (pkgs))
+        installed = rpm_database.installed(self.packages)
         for p in self.packages:
-            thread = process.ProcessThread("/bin/rpm", None, "test",
-                                           ["/bin/rpm",
-                                            "-q",
-                                            "%s" % p],
-                                           None, None, None, None)
-            if thread.launch():
+            if p in installed:
                 logger.info("Package '%s' is already installed" % p)
             else:
                 logger.info("Package '%s' is installing..." % p)
@@ -75,7 +73,31 @@ class InstallPackagesApt(State):
                          armonic.utils.OsTypeUbuntu()]
 
     def _is_installed(self, package):
-        return run("/usr/bin/dpkg", ["--status", "%s" % package])
+        return dpkg_database.is_installed(package)
+
+    def _apt_get(self, action, packages, options=[]):
+        """Run apt-get on all packages in a single transaction.
+
+        :raises AptGetInstallError: if the transaction failed. Errors
+            of each package are logged.
+        """
+        apt = ProcessThread("/usr/bin/apt-get", None, "test",
+                            ["/usr/bin/apt-get", action, "--assume-yes"] +
+                            options + packages,
+                            env=APT_ENV)
+        if apt.launch():
+            logger.info("%s.%s apt-get %s %s done." %
+                        (self.lf_name, self.name, action, " ".join(packages)))
+            return
+        errors = parse_apt_errors(apt.output)
+        for package, messages in sorted(errors.items()):
+            for message in messages:
+                logger.error("%s.%s apt-get %s %s failed: %s" %
+                             (self.lf_name, self.name, action, package, message))
+        logger.info("%s.%s apt-get %s %s failed." %
+                    (self.lf_name, self.name, action, " ".join(packages)))
+        raise AptGetInstallError("apt-get %s failed for packages: %s" % (
+            action, ", ".join(sorted(errors) or packages)))
 
     def enter(self):
         pkgs = " ".join(self.packages)
@@ -83,22 +105,14 @@ class InstallPackagesApt(State):
                     self.lf_name,
                     self.name,
                     pkgs)
+        installed = dpkg_database.installed(self.packages)
         for p in self.packages:
-            if self._is_installed(p):
+            if p in installed:
                 logger.info("package %s is already installed" % p)
-            else:
-                logger.info("package %s is installing..." % p)
-
-                if run("/usr/bin/apt-get", ["install",
-                                            "--assume-yes",
-                                            "%s" % p],
-                       env={"DEBIAN_FRONTEND": "noninteractive"}):
-                    logger.info("%s.%s apt-get install %s done." %
-                                (self.lf_name, self.name, p))
-                else:
-                    logger.info("%s.%s apt-get install %s failed." %
-                                (self.lf_name, self.name, p))
-                    raise AptGetInstallError()
+        missing = [p for p in self.packages if p not in installed]
+        if missing:
+            logger.info("packages %s are installing..." % " ".join(missing))
+            self._apt_get("install", missing)
 
     def leave(self):
         """Remove specified packages. Be careful, 'purge' option is applied."""
@@ -107,19 +121,14 @@ class InstallPackagesApt(State):
             for p in self.packages:
                 logger.info("\t%s" % p)
 
+        installed = dpkg_database.installed(self.packages)
         for p in self.packages:
-            if self._is_installed(p):
-                logger.debug("Uninstalling package %s..." % p)
-                if not run("/usr/bin/apt-get", ["remove",
-                                                "--assume-yes",
-                                                "--purge",
-                                                "%s" % p],
-                           env={"DEBIAN_FRONTEND": "noninteractive"}):
-                    logger.debug("Some errors during "
-                                 "uninstallation of package %s!" % p)
-                    raise AptGetInstallError()
-            else:
+            if p not in installed:
                 logger.debug("Package %s is not installed!" % p)
+        to_remove = [p for p in self.packages if p in installed]
+        if to_remove:
+            logger.debug("Uninstalling packages %s..." % " ".join(to_remove))
+            self._apt_get("remove", to_remove, ["--purge"])
 
 
 class InstallPackages(MetaState):
@@ -204,7 +213,7 @@ class RepositoriesApt(State):
                 logger.warning("Key %s could not be added!" % key)
                 raise Exception("Key %s has not been added" % key)
 
-        run("/usr/bin/apt-get", ["update"])
+        apt_refresh.refresh()
 
     def _is_repository_exist(self, repositories, repository):
         """This method is not really strong. In some case, it's doens't
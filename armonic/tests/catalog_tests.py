@@ -0,0 +1,102 @@
+import unittest
+
+from armonic.client.utils import NOT_MODIFIED
+from armonic.xmpp.client import XMPPError
+from armonic.xmpp.catalog import ProvideCatalog, xpath_to_regex
+
+
+def provide(xpath, tags=[], label=None):
+    extra = {'tags': tags}
+    if label is not None:
+        extra['label'] = label
+    return {'xpath': xpath, 'name': xpath.split("/")[-1], 'extra': extra}
+
+
+class FakeClient(object):
+    """Answer provide calls like agents supporting if_generation."""
+
+    def __init__(self):
+        self.agents = {}
+        self.calls = []
+
+    def call_conditional(self, jid, deployment_id, method, args, kwargs,
+                         if_generation=None, timeout=None):
+        self.calls.append((jid, if_generation))
+        if jid not in self.agents:
+            raise XMPPError("Failed to contact %s" % jid)
+        generation, provides = self.agents[jid]
+        if generation == if_generation:
+            return (generation, NOT_MODIFIED)
+        return (generation, provides)
+
+
+class TestXPathToRegex(unittest.TestCase):
+
+    def match(self, xpath, provide_xpath):
+        return bool(xpath_to_regex(xpath).match("/" + provide_xpath))
+
+    def test_match(self):
+        self.assertTrue(self.match("//*", "Mysql/Active/start"))
+        self.assertTrue(self.match("//Mysql//start", "Mysql/Active/start"))
+        self.assertTrue(self.match("//Mysql/*/start", "Mysql/Active/start"))
+        self.assertTrue(self.match("//start", "Mysql/Active/start"))
+        self.assertFalse(self.match("//Mysql", "Mysql/Active/start"))
+        self.assertFalse(self.match("//Mysql/start", "Mysql/Active/start"))
+        self.assertFalse(self.match("//Active/start", "Mysql/Active/stop"))
+
+    def test_not_supported(self):
+        self.assertIsNone(xpath_to_regex("/vm/Mysql"))
+        self.assertIsNone(xpath_to_regex("//*[@label='foo']"))
+
+
+class TestProvideCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.agents = {
+            "a": (1, [provide("Mysql/Active/start", ["db"], "Start MySQL"),
+                      provide("Wordpress/Active/get_site", ["web"])]),
+            "b": (1, [provide("Mysql/Active/start", ["db"], "Start MySQL")])}
+        self.catalog = ProvideCatalog(self.client)
+        self.catalog.refresh("a")
+        self.catalog.refresh("b")
+
+    def test_indexes(self):
+        self.assertEqual([p['xpath'] for p in self.catalog.provides()],
+                         ["Mysql/Active/start", "Wordpress/Active/get_site"])
+        self.assertEqual(self.catalog.locations("Mysql/Active/start"), ["a", "b"])
+        self.assertEqual(self.catalog.by_tag("web"), ["Wordpress/Active/get_site"])
+        self.assertEqual(self.catalog.by_label("Start MySQL"), ["Mysql/Active/start"])
+        self.assertEqual(self.catalog.by_label("get_site"), ["Wordpress/Active/get_site"])
+
+    def test_match(self):
+        self.assertEqual([jid for jid, p in self.catalog.match("//start")], ["a", "b"])
+        self.assertEqual(len(self.catalog.match("//*", "a")), 2)
+        self.assertIsNone(self.catalog.match("/vm/Mysql"))
+
+    def test_not_modified(self):
+        self.catalog.refresh("a")
+        self.assertEqual(self.client.calls[-1], ("a", 1))
+        self.assertEqual(self.catalog.locations("Mysql/Active/start"), ["a", "b"])
+
+    def test_changed(self):
+        self.client.agents["a"] = (2, [provide("Mysql/Active/start", ["db"])])
+        self.catalog.refresh("a")
+        self.assertEqual(self.catalog.by_tag("web"), [])
+        self.assertEqual(self.catalog.locations("Mysql/Active/start"), ["a", "b"])
+
+    def test_remove(self):
+        self.catalog.remove("b")
+        self.assertEqual(self.catalog.agents(), ["a"])
+        self.assertEqual(self.catalog.locations("Mysql/Active/start"), ["a"])
+        self.catalog.remove("a")
+        self.assertEqual(self.catalog.provides(), [])
+        self.assertEqual(self.catalog.by_tag("db"), [])
+
+    def test_unreachable(self):
+        self.assertFalse(self.catalog.refresh("c"))
+        self.assertEqual(self.catalog.agents(), ["a", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from armonic import State, Lifecycle, Transition
+from armonic.serialize import Serialize, NotModified
+from armonic.client.utils import GenerationCache, NOT_MODIFIED
+from armonic.utils import OsTypeAll
+
+
+class GenStateA(State):
+    pass
+
+
+class GenStateB(State):
+    pass
+
+
+class GenerationLF(Lifecycle):
+    initial_state = GenStateA()
+    transitions = [Transition(GenStateA(), GenStateB())]
+
+
+class TestGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.lfm = Serialize(os_type=OsTypeAll())
+
+    def test_not_modified(self):
+        generation = self.lfm.generation
+        with self.assertRaises(NotModified):
+            self.lfm._dispatch("lifecycle", "//GenerationLF", if_generation=generation)
+        self.assertEqual(self.lfm._dispatch("lifecycle", "//GenerationLF",
+                                            if_generation=generation - 1),
+                         ["/vm/GenerationLF"])
+
+    def test_state_change(self):
+        generation = self.lfm.generation
+        self.lfm._dispatch("state_goto", "//GenerationLF/GenStateB",
+                           if_generation=generation)
+        self.assertTrue(self.lfm.generation > generation)
+        self.assertEqual(self.lfm._dispatch("state_current", "//GenerationLF",
+                                            if_generation=generation),
+                         [{"xpath": "/vm/GenerationLF/GenStateB",
+                           "state": "GenStateB"}])
+
+
+class TestGenerationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = GenerationCache(size=2)
+        self.generation = 1
+        self.sent = []
+
+    def send(self, if_generation):
+        self.sent.append(if_generation)
+        if if_generation == self.generation:
+            return (self.generation, NOT_MODIFIED)
+        return (self.generation, ["value", self.generation])
+
+    def call(self, method, *args):
+        return self.cache.call(method, args, {}, self.send)
+
+    def test_hit(self):
+        self.assertEqual(self.call("info"), ["value", 1])
+        self.assertEqual(self.call("info"), ["value", 1])
+        self.assertEqual(self.sent, [None, 1])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_changed(self):
+        self.call("info")
+        self.generation = 2
+        self.assertEqual(self.call("info"), ["value", 2])
+        self.assertEqual(self.call("info"), ["value", 2])
+        self.assertEqual(self.sent, [None, 1, 2])
+
+    def test_copy(self):
+        self.call("info")
+        self.call("info").append("foo")
+        self.assertEqual(self.call("info"), ["value", 1])
+
+    def test_not_cacheable(self):
+        self.call("provide_call")
+        self.call("provide_call")
+        self.assertEqual(self.sent, [None, None])
+
+    def test_size(self):
+        self.call("lifecycle", "a")
+        self.call("lifecycle", "b")
+        self.call("lifecycle", "c")
+        self.call("lifecycle", "a")
+        self.assertEqual(self.sent, [None, None, None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from armonic.lifecycle import State, LifecycleManager, Lifecycle, Transition
+from armonic.require import Require
+from armonic.variable import VString
+
+
+class IdemA(State):
+    pass
+
+
+class IdemB(State):
+    idempotent = True
+    entered = 0
+
+    @Require('conf', [VString('name')])
+    def enter(self, requires):
+        IdemB.entered += 1
+
+
+class IdemC(State):
+    entered = 0
+
+    def enter(self):
+        IdemC.entered += 1
+
+
+class IdempotentLF(Lifecycle):
+    initial_state = IdemA()
+    transitions = [Transition(IdemA(), IdemB()),
+                   Transition(IdemB(), IdemC())]
+
+
+class TestIdempotentState(unittest.TestCase):
+
+    def setUp(self):
+        self.lfm = LifecycleManager()
+
+    def goto(self, state, name="foo"):
+        self.lfm.state_goto("//IdempotentLF/%s" % state,
+                            requires=[[("//IdempotentLF//conf/name", name)]])
+
+    def test_idempotent(self):
+        IdemB.entered = IdemC.entered = 0
+        self.goto("IdemC")
+        self.goto("IdemA")
+        self.goto("IdemC")
+        # IdemB is not entered again with the same values
+        self.assertEqual((IdemB.entered, IdemC.entered), (1, 2))
+        self.assertEqual(self.lfm.state_current("//IdempotentLF")[0].name, "IdemC")
+        self.goto("IdemA")
+        self.goto("IdemB", name="bar")
+        self.assertEqual(IdemB.entered, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
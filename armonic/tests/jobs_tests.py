@@ -0,0 +1,142 @@
+import logging
+import unittest
+import threading
+
+import armonic.process
+from armonic.common import PROCESS_LEVEL
+from armonic.jobs import JobTable, JobNotFound, JobCancelled, check_cancelled, \
+    OutsideJobFilter, DONE, FAILED, CANCELLED, RUNNING, PENDING
+
+
+class TestJobTable(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = JobTable()
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def blocking(self):
+        self.started.set()
+        self.release.wait(5)
+        check_cancelled()
+        return "released"
+
+    def wait_all(self):
+        # Jobs are run in order: wait for a job submitted after the others
+        done = threading.Event()
+        self.jobs.submit("marker", done.set)
+        done.wait(5)
+
+    def test_result(self):
+        job = self.jobs.submit("add", lambda a, b: a + b, 1, b=2)
+        self.wait_all()
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(job.result, 3)
+        self.assertIs(self.jobs.get(job.id), job)
+
+    def test_failed(self):
+        job = self.jobs.submit("fail", lambda: 1 / 0)
+        self.wait_all()
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.to_primitive()['exception']['code'],
+                         "ZeroDivisionError")
+
+    def test_cancel_pending(self):
+        running = self.jobs.submit("blocking", self.blocking)
+        self.started.wait(5)
+        pending = self.jobs.submit("pending", lambda: "not run")
+        self.assertEqual(pending.status, PENDING)
+        self.assertEqual(self.jobs.cancel(pending.id).status, CANCELLED)
+        self.release.set()
+        self.wait_all()
+        self.assertEqual(running.result, "released")
+        self.assertIsNone(pending.result)
+
+    def test_cancel_running(self):
+        job = self.jobs.submit("blocking", self.blocking)
+        self.started.wait(5)
+        self.jobs.cancel(job.id)
+        self.assertEqual(job.status, RUNNING)
+        self.assertTrue(job.cancel_requested)
+        self.release.set()
+        self.wait_all()
+        self.assertEqual(job.status, CANCELLED)
+        self.assertIsInstance(job.exception, JobCancelled)
+
+    def test_retention(self):
+        self.jobs.retention = 0
+        job = self.jobs.submit("noop", lambda: None)
+        self.wait_all()
+        with self.assertRaises(JobNotFound):
+            self.jobs.get(job.id)
+
+    def test_max_finished(self):
+        self.jobs.max_finished = 2
+        jobs = [self.jobs.submit("noop", lambda: None) for i in range(3)]
+        self.wait_all()
+        self.assertEqual(len(self.jobs.jobs()), 2)
+        with self.assertRaises(JobNotFound):
+            self.jobs.get(jobs[0].id)
+
+    def test_check_cancelled_outside_job(self):
+        check_cancelled()
+
+    def test_lock(self):
+        self.jobs.submit("blocking", self.blocking)
+        self.started.wait(5)
+        # Mutating calls wait for the running job
+        self.assertFalse(self.jobs.lock.acquire(False))
+        self.release.set()
+        self.wait_all()
+        self.assertTrue(self.jobs.lock.acquire(False))
+        self.jobs.lock.release()
+
+    def test_logs(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.addFilter(OutsideJobFilter())
+        logger = logging.getLogger("armonic.tests.jobs")
+        logger.addHandler(handler)
+        try:
+            job = self.jobs.submit("log", logger.warning, "from job")
+            self.wait_all()
+            logger.warning("outside job")
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual([r.getMessage() for r in records], ["outside job"])
+        logs = job.to_primitive(log_offset=0)['logs']
+        self.assertEqual([l[4] for l in logs], ["from job"])
+        self.assertEqual(job.to_primitive(log_offset=1)['logs'], [])
+
+    def test_process_logs(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.addFilter(OutsideJobFilter())
+        logger = logging.getLogger("armonic.process")
+        level = logger.level
+        logger.setLevel(PROCESS_LEVEL)
+        logger.addHandler(handler)
+
+        def processes():
+            armonic.process.run('/bin/echo', ['hello'])
+            armonic.process.run_many([['/bin/echo', 'world']])
+        try:
+            job = self.jobs.submit("process", processes)
+            self.wait_all()
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual(records, [])
+        messages = [l[4] for l in job.to_primitive(log_offset=0)['logs']]
+        self.assertIn("hello", messages)
+        self.assertIn("world", messages)
+        self.assertIn("Finished `/bin/echo hello` command", messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
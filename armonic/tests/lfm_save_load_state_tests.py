@@ -1,10 +1,12 @@
+import json
 import unittest
+import time
 import logging
 import tempfile
 
 from armonic import State, LifecycleManager, Lifecycle, Transition, \
                     MetaState, Require
-from armonic.persist import Persist
+from armonic.persist import Persist, StateStore
 from armonic.variable import VString
 
 
@@ -41,13 +43,67 @@ class LFMStateLoad(Lifecycle):
                    Transition(StateC(), StateE())]
 
 
+class ResumeA(State):
+    pass
+
+
+class ResumeB(State):
+    pass
+
+
+class ResumeC(State):
+    fail = True
+    value = None
+
+    @Require('baz', [VString('qux')])
+    def enter(self, requires):
+        if self.fail:
+            raise Exception("Entering ResumeC failed")
+        ResumeC.value = requires.baz.variables().qux.value
+
+
+class LFMResume(Lifecycle):
+    initial_state = ResumeA()
+    transitions = [Transition(ResumeA(), ResumeB()),
+                   Transition(ResumeB(), ResumeC())]
+
+
+class AgentKilled(BaseException):
+    pass
+
+
+class CrashA(State):
+    pass
+
+
+class CrashB(State):
+    entered = 0
+
+    def enter(self):
+        CrashB.entered += 1
+
+
+class CrashC(State):
+    crash = True
+
+    def enter(self):
+        if self.crash:
+            raise AgentKilled()
+
+
+class LFMCrash(Lifecycle):
+    initial_state = CrashA()
+    transitions = [Transition(CrashA(), CrashB()),
+                   Transition(CrashB(), CrashC())]
+
+
 class TestLFMStateLoad(unittest.TestCase):
 
     def setUp(self):
         self.pconfig = Persist(save_state=True)
 
     def test_save_load(self):
-        fh, state_path = tempfile.mkstemp(suffix="_%s%s")
+        fh, state_path = tempfile.mkstemp(suffix=".db")
         self.pconfig.load_state = False
         self.pconfig.save_state = True
         self.pconfig.state_path = state_path
@@ -61,7 +117,7 @@ class TestLFMStateLoad(unittest.TestCase):
         self.assertEqual(lfm.state_current('//LFMStateLoad')[0].name, "StateC")
 
     def test_metastate(self):
-        fh, state_path = tempfile.mkstemp(suffix="%s%s")
+        fh, state_path = tempfile.mkstemp(suffix=".db")
         self.pconfig.load_state = False
         self.pconfig.save_state = True
         self.pconfig.state_path = state_path
@@ -76,6 +132,104 @@ class TestLFMStateLoad(unittest.TestCase):
         lfm = LifecycleManager()
         self.assertEqual(lfm.state_current('//LFMStateLoad')[0].name, "StateE")
 
+    def test_dirty_only(self):
+        fh, state_path = tempfile.mkstemp(suffix=".db")
+        self.pconfig.load_state = False
+        self.pconfig.save_state = True
+        self.pconfig.state_path = state_path
+        self.pconfig.ressources = []
+        lfm = LifecycleManager()
+        self.pconfig.save()
+        writes = []
+        write = self.pconfig.store.write
+        self.pconfig.store.write = lambda values, deleted=[]: (writes.append(values),
+                                                               write(values, deleted))
+        self.pconfig.save()
+        self.assertEqual(writes, [])
+        lfm.state_goto("//LFMStateLoad/StateC", requires=[[('//LFMStateLoad//bar/foo', 'test')]])
+        # The plan is written before the state_goto and after each step
+        self.assertEqual(len(writes), 3)
+        self.pconfig.save()
+        self.assertTrue(all(len(w) < len(self.pconfig.ressources) for w in writes))
+        self.pconfig.save()
+        self.assertEqual(len(writes), 4)
+        state = json.loads(StateStore(state_path).load()["lifecycle:/vm/LFMStateLoad"])
+        self.assertEqual(state, {"stack": ["StateA", "StateB", "StateC"], "plan": None})
+
+    def test_checkpointer(self):
+        fh, state_path = tempfile.mkstemp(suffix=".db")
+        self.pconfig.load_state = False
+        self.pconfig.save_state = True
+        self.pconfig.state_path = state_path
+        self.pconfig.ressources = []
+        lfm = LifecycleManager()
+        lfm.state_goto("//LFMStateLoad/StateC", requires=[[('//LFMStateLoad//bar/foo', 'test')]])
+        checkpointer = self.pconfig.start_checkpointer(interval=0.1)
+        try:
+            lf = lfm.lifecycle_by_name("LFMStateLoad")
+            lf._pop_state()
+            lf._pop_state()
+            # All transitions are written in a single transaction
+            time.sleep(0.3)
+            self.assertEqual(checkpointer.checkpoints, 1)
+            # The agent state is written without calling save
+            state = json.loads(StateStore(state_path).load()["lifecycle:/vm/LFMStateLoad"])
+            self.assertEqual(state["stack"], ["StateA"])
+        finally:
+            self.pconfig.stop_checkpointer()
+
+    def test_resume(self):
+        fh, state_path = tempfile.mkstemp(suffix=".db")
+        self.pconfig.load_state = False
+        self.pconfig.save_state = True
+        self.pconfig.state_path = state_path
+        self.pconfig.ressources = []
+        lfm = LifecycleManager()
+        with self.assertRaises(Exception):
+            lfm.state_goto("//LFMResume/ResumeC", requires=[[('//LFMResume//baz/qux', 'test')]])
+        self.assertEqual(lfm.state_current('//LFMResume')[0].name, "ResumeB")
+
+        # The agent restarts without saving its state
+        self.pconfig.ressources = []
+        self.pconfig.load_state = True
+        lfm = LifecycleManager()
+        self.assertEqual(lfm.state_current('//LFMResume')[0].name, "ResumeB")
+        [(lf, plan)] = lfm.state_goto_plans()
+        self.assertEqual(plan['state'], "ResumeC")
+        self.assertEqual(plan['done'], 1)
+        self.assertIn("Entering ResumeC failed", plan['error'])
+
+        ResumeC.fail = False
+        lfm.state_goto_resume("//LFMResume")
+        self.assertEqual(lfm.state_current('//LFMResume')[0].name, "ResumeC")
+        self.assertEqual(ResumeC.value, "test")
+        self.assertEqual(lfm.state_goto_plans(), [])
+
+    def test_resume_interrupted(self):
+        fh, state_path = tempfile.mkstemp(suffix=".db")
+        self.pconfig.load_state = False
+        self.pconfig.save_state = True
+        self.pconfig.state_path = state_path
+        self.pconfig.ressources = []
+        lfm = LifecycleManager()
+        with self.assertRaises(AgentKilled):
+            lfm.state_goto("//LFMCrash/CrashC")
+
+        # The agent is killed: completed steps have been written
+        self.pconfig.ressources = []
+        self.pconfig.load_state = True
+        self.pconfig.store.close()
+        self.pconfig._store = None
+        lfm = LifecycleManager()
+        [(lf, plan)] = lfm.state_goto_plans()
+        self.assertEqual((plan['done'], plan['error']), (1, None))
+
+        CrashC.crash = False
+        self.assertEqual(lfm.state_goto_resume_interrupted(), [lf.get_xpath()])
+        self.assertEqual(lfm.state_current('//LFMCrash')[0].name, "CrashC")
+        self.assertEqual(CrashB.entered, 1)
+        self.assertEqual(lfm.state_goto_plans(), [])
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,174 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+from armonic.packages import parse_apt_errors, DpkgDatabase, RpmDatabase, \
+    RepositoryRefresh
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "packages")
+
+APT_NOT_FOUND = """\
+Reading package lists...
+Building dependency tree...
+Reading state information...
+E: Unable to locate package foo
+E: Package 'bar' has no installation candidate
+"""
+
+APT_UNMET = """\
+Reading package lists...
+Some packages could not be installed. This may mean that you have
+requested an impossible situation or if you are using the unstable
+distribution that some required packages have not yet been created
+or been moved out of Incoming.
+The following information may help to resolve the situation:
+
+The following packages have unmet dependencies:
+ mysql-server : Depends: mysql-server-5.5 but it is not going to be installed
+                Recommends: libhtml-template-perl
+ php5-mysql:amd64 : Depends: php5-common (= 5.4.4-14) but 5.4.45-0 is to be installed
+E: Unable to correct problems, you have held broken packages.
+"""
+
+APT_DPKG = """\
+Setting up mysql-server-5.5 (5.5.47-0+deb7u1) ...
+dpkg: error processing mysql-server-5.5 (--configure):
+ subprocess installed post-installation script returned error exit status 1
+dpkg: error processing archive /var/cache/apt/archives/apache2_2.2.22-13_amd64.deb (--unpack):
+ trying to overwrite '/etc/apache2', which is also in package foo
+Errors were encountered while processing:
+ mysql-server-5.5
+ mysql-server
+E: Sub-process /usr/bin/dpkg returned an error code (1)
+"""
+
+
+class TestPackagesParsers(unittest.TestCase):
+
+    def test_apt_not_found(self):
+        self.assertEqual(parse_apt_errors(APT_NOT_FOUND),
+                         {"foo": ["E: Unable to locate package foo"],
+                          "bar": ["E: Package 'bar' has no installation candidate"]})
+
+    def test_apt_unmet_dependencies(self):
+        errors = parse_apt_errors(APT_UNMET)
+        self.assertEqual(sorted(errors), ["mysql-server", "php5-mysql"])
+        self.assertEqual(errors["mysql-server"],
+                         ["Depends: mysql-server-5.5 but it is not going to be installed",
+                          "Recommends: libhtml-template-perl"])
+
+    def test_apt_dpkg_errors(self):
+        errors = parse_apt_errors(APT_DPKG)
+        self.assertEqual(sorted(errors), ["apache2", "mysql-server", "mysql-server-5.5"])
+        self.assertEqual(len(errors["mysql-server-5.5"]), 2)
+
+
+class FixtureRpmDatabase(RpmDatabase):
+    path = os.path.join(DATA, "rpm_qa")
+
+    def command(self):
+        return ["/bin/cat", self.path]
+
+
+class TestPackageDatabases(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.status = os.path.join(self.tmp, "status")
+        shutil.copy(os.path.join(DATA, "dpkg_status"), self.status)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_dpkg(self):
+        database = DpkgDatabase(self.status)
+        self.assertEqual(sorted(database.packages()), ["apache2", "libc6", "wordpress"])
+        self.assertEqual(database.packages()["libc6"], "2.13-38+deb7u10")
+        self.assertTrue(database.is_installed("apache2"))
+        self.assertFalse(database.is_installed("mysql-server"))
+        self.assertEqual(database.installed(["apache2", "php5-mysql", "foo"]),
+                         set(["apache2"]))
+
+    def test_dpkg_cache(self):
+        database = DpkgDatabase(self.status)
+        packages = database.packages()
+        self.assertIs(database.packages(), packages)
+        with open(self.status, "a") as f:
+            f.write("\nPackage: foo\nStatus: install ok installed\nVersion: 1.0\n")
+        mtime = time.time() + 10
+        os.utime(self.status, (mtime, mtime))
+        self.assertTrue(database.is_installed("foo"))
+
+    def test_missing_database(self):
+        self.assertEqual(DpkgDatabase(os.path.join(self.tmp, "foo")).packages(), {})
+
+    def test_rpm(self):
+        database = FixtureRpmDatabase()
+        self.assertEqual(database.packages(), {"apache": "2.4.10-6.mbs2",
+                                               "mariadb": "10.0.17-1.mbs2",
+                                               "glibc": "2.20-6.mbs2"})
+        self.assertTrue(database.is_installed("mariadb"))
+
+
+class TestRepositoryRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.conf = os.path.join(self.tmp, "sources.list")
+        self.conf_dir = os.path.join(self.tmp, "sources.list.d")
+        os.mkdir(self.conf_dir)
+        with open(self.conf, "w") as f:
+            f.write("deb http://ftp.debian.org/debian wheezy main\n")
+        self.counter = os.path.join(self.tmp, "counter")
+        self.refresh = RepositoryRefresh(
+            ["/bin/sh", "-c", "sleep 0.2; echo >> %s" % self.counter],
+            [self.conf, self.conf_dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def refreshes(self):
+        if not os.path.exists(self.counter):
+            return 0
+        return len(open(self.counter).readlines())
+
+    def test_configuration_change(self):
+        self.assertTrue(self.refresh.refresh())
+        self.assertTrue(self.refresh.refresh())
+        self.assertEqual(self.refreshes(), 1)
+        with open(os.path.join(self.conf_dir, "foo.list"), "w") as f:
+            f.write("deb http://foo/debian wheezy main\n")
+        self.assertFalse(self.refresh.is_fresh())
+        self.refresh.refresh()
+        self.assertEqual(self.refreshes(), 2)
+        self.refresh.refresh(force=True)
+        self.assertEqual(self.refreshes(), 3)
+
+    def test_ttl(self):
+        self.refresh.ttl = 0
+        self.refresh.refresh()
+        self.refresh.refresh()
+        self.assertEqual(self.refreshes(), 2)
+
+    def test_failure(self):
+        refresh = RepositoryRefresh(["/bin/false"], [self.conf])
+        self.assertFalse(refresh.refresh())
+        self.assertFalse(refresh.is_fresh())
+
+    def test_concurrent(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.refresh.refresh()))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(self.refreshes(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import armonic.common
+import armonic.process
+from armonic.process import ProcessThread, RingBuffer, OutputNotFound, get_output
+from armonic.serialize import Serialize
+from armonic.client.utils import iter_process_output
+from armonic.utils import OsTypeAll
+
+
+class SmallProcessThread(ProcessThread):
+    output_retention = 10
+
+
+class FakeClient(object):
+
+    def __init__(self, lfm):
+        self.lfm = lfm
+
+    def call(self, method, *args, **kwargs):
+        return self.lfm._dispatch(method, *args, **kwargs)
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        buf = RingBuffer(4)
+        buf.append("012")
+        self.assertEqual(buf.read(1, 10), (1, "12"))
+        buf.append("3456")
+        self.assertEqual((buf.start, buf.end), (3, 7))
+        self.assertEqual(buf.read(0, 2), (3, "34"))
+        self.assertEqual(buf.read(7, 2), (7, ""))
+
+
+class TestProcessOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        armonic.common.PROCESS_OUTPUT_DIR = self.output_dir
+
+    def tearDown(self):
+        armonic.common.PROCESS_OUTPUT_DIR = None
+        armonic.process.MAX_OUTPUTS = 100
+        shutil.rmtree(self.output_dir)
+
+    def run_command(self, command):
+        thread = SmallProcessThread("test", None, "test", ["/bin/sh", "-c", command])
+        thread.launch()
+        return thread
+
+    def test_retention(self):
+        thread = self.run_command("seq 1 1000")
+        self.assertEqual(thread.output, "\n999\n1000\n")
+        self.assertEqual(thread.output_size, len(open(thread.output_path).read()))
+        self.assertEqual(thread.read_output(0, 4), (0, "1\n2\n"))
+
+    def test_without_file(self):
+        armonic.common.PROCESS_OUTPUT_DIR = None
+        thread = self.run_command("seq 1 1000")
+        self.assertIsNone(thread.output_path)
+        self.assertEqual(thread.read_output(0, 4), (thread.output_size - 10, "\n999"))
+
+    def test_max_outputs(self):
+        armonic.process.MAX_OUTPUTS = 1
+        first = self.run_command("echo first")
+        self.run_command("echo second")
+        with self.assertRaises(OutputNotFound):
+            get_output(first.output_id)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir,
+                                                     "%s.log" % first.output_id)))
+
+    def test_agent_methods(self):
+        thread = self.run_command("seq 1 1000")
+        lfm = Serialize(os_type=OsTypeAll())
+        outputs = lfm.process_outputs()
+        self.assertEqual(outputs[-1]['id'], thread.output_id)
+        self.assertEqual(outputs[-1]['code'], 0)
+        chunk = lfm.process_output(thread.output_id, 2, 4)
+        self.assertEqual(chunk['data'], "2\n3\n")
+        self.assertEqual(chunk['next_offset'], 6)
+        self.assertTrue(chunk['finished'])
+        data = "".join(iter_process_output(FakeClient(lfm), thread.output_id, size=100))
+        self.assertEqual(data.split(), [str(i) for i in range(1, 1001)])
+
+    def test_agent_utf8_chunks(self):
+        # "\xc3\xa9" is split by chunks of 3 bytes
+        thread = self.run_command("printf 'ab\\303\\251cd\\342\\202\\254'")
+        lfm = Serialize(os_type=OsTypeAll())
+        chunk = lfm.process_output(thread.output_id, 0, 3)
+        self.assertEqual((chunk['data'], chunk['next_offset']), (u"ab", 2))
+        chunk = lfm.process_output(thread.output_id, 3, 3)
+        # A chunk doesn't start in the middle of a character
+        self.assertEqual((chunk['data'], chunk['offset']), (u"cd", 4))
+        data = u"".join(iter_process_output(FakeClient(lfm), thread.output_id, size=3))
+        self.assertEqual(data, u"ab\xe9cd\u20ac")
+
+
+if __name__ == '__main__':
+    unittest.main()
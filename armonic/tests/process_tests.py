@@ -0,0 +1,90 @@
+import time
+import unittest
+import logging
+
+from armonic.common import PROCESS_LEVEL
+from armonic.process import ProcessThread, ProcessExecutor, ProcessTimeout, \
+    run, run_many
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        if record.levelno == PROCESS_LEVEL:
+            self.messages.append(record.getMessage())
+
+
+class TestProcessThread(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("armonic.process")
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.logger.setLevel(PROCESS_LEVEL)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    def run_command(self, command):
+        thread = ProcessThread("test", None, "test", ["/bin/sh", "-c", command])
+        thread.read_size = 3
+        thread.launch()
+        return thread
+
+    def test_lines(self):
+        thread = self.run_command("printf 'first line\\nsecond'; sleep 0.1; printf ' line\\nlast'; exit 3")
+        self.assertEqual(thread.code, 3)
+        self.assertEqual(thread.output, "first line\nsecond line\nlast")
+        self.assertEqual(self.handler.messages[:3], ["first line", "second line", "last"])
+        self.assertTrue(self.handler.messages[3].startswith("Finished"))
+
+    def test_big_output(self):
+        thread = self.run_command("seq 1 10000")
+        self.assertEqual(thread.code, 0)
+        self.assertEqual(thread.output.split(), [str(i) for i in range(1, 10001)])
+        self.assertEqual(len(self.handler.messages), 10001)
+
+
+class TestProcessExecutor(unittest.TestCase):
+
+    def test_run_many(self):
+        start = time.time()
+        processes = run_many([["/bin/sh", "-c", "sleep 0.3; echo %d; exit %d" % (i, i)]
+                              for i in range(4)])
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual([p.code for p in processes], [0, 1, 2, 3])
+        self.assertEqual([p.output for p in processes], ["0\n", "1\n", "2\n", "3\n"])
+
+    def test_max_workers(self):
+        executor = ProcessExecutor(max_workers=1)
+        start = time.time()
+        futures = [executor.submit(["/bin/sleep", "0.2"]) for i in range(3)]
+        self.assertTrue(all(f.result() for f in futures))
+        self.assertTrue(time.time() - start >= 0.6)
+
+    def test_timeout(self):
+        executor = ProcessExecutor(timeout=0.2)
+        future = executor.submit(["/bin/sleep", "10"])
+        with self.assertRaises(ProcessTimeout):
+            future.result()
+        self.assertFalse(future.thread.isAlive())
+        self.assertFalse(run("/bin/sleep", ["10"], timeout=0.2))
+
+    def test_kill(self):
+        # The process ignores SIGTERM
+        thread = ProcessThread("test", None, "test",
+                               ["/bin/sh", "-c", "trap '' TERM; sleep 10"])
+        thread.start()
+        time.sleep(0.2)
+        self.assertFalse(thread.wait(0.1, kill_delay=0.2))
+        self.assertEqual(thread.code, -9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import unittest
+import logging
+import socket
+import time
+
+from armonic.common import BatchingHandler
+from armonic.protocol import send_frame, recv_frame, get_codec, \
+    codec_names, log_record_to_primitive, log_record_from_primitive, \
+    ProtocolError, FRAME_HEADER, FLAG_COMPRESSED, COMPRESSION_THRESHOLD, \
+    compress, decompress
+
+
+class TestFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.left, self.right = socket.socketpair()
+
+    def tearDown(self):
+        self.left.close()
+        self.right.close()
+
+    def test_roundtrip(self):
+        request = {'method': 'provide_call',
+                   'args': [],
+                   'kwargs': {'requires': [[["//a/b", {"0": "v"}]]]}}
+        for name in codec_names():
+            codec = get_codec(name)
+            send_frame(self.left, request, codec, last=True)
+            last, recv_codec, obj = recv_frame(self.right)
+            self.assertTrue(last)
+            self.assertEqual(recv_codec.name, name)
+            self.assertEqual(obj, request)
+
+    def test_not_last(self):
+        send_frame(self.left, [1, 2], get_codec("json"))
+        last, codec, obj = recv_frame(self.right)
+        self.assertFalse(last)
+        self.assertEqual(obj, [1, 2])
+
+    def test_compressed(self):
+        obj = ["x" * 100] * (COMPRESSION_THRESHOLD / 100)
+        send_frame(self.left, obj, get_codec("json"), last=True, compression=True)
+        header = self.right.recv(FRAME_HEADER.size, socket.MSG_PEEK)
+        size, flags, codec_id = FRAME_HEADER.unpack(header)
+        self.assertTrue(flags & FLAG_COMPRESSED)
+        self.assertTrue(size < COMPRESSION_THRESHOLD)
+        last, codec, recv_obj = recv_frame(self.right)
+        self.assertEqual(recv_obj, obj)
+
+    def test_not_compressed_under_threshold(self):
+        send_frame(self.left, ["x"], get_codec("json"), compression=True)
+        header = self.right.recv(FRAME_HEADER.size, socket.MSG_PEEK)
+        self.assertFalse(FRAME_HEADER.unpack(header)[1] & FLAG_COMPRESSED)
+        self.assertEqual(recv_frame(self.right)[2], ["x"])
+
+    def test_unknown_codec(self):
+        self.left.sendall(FRAME_HEADER.pack(2, 1, 200) + "{}")
+        with self.assertRaises(ProtocolError):
+            recv_frame(self.right)
+
+    def test_closed_connection(self):
+        self.left.sendall(FRAME_HEADER.pack(10, 1, 1) + "{}")
+        self.left.close()
+        with self.assertRaises(ProtocolError):
+            recv_frame(self.right)
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_incompressible(self):
+        data = os.urandom(COMPRESSION_THRESHOLD * 2)
+        self.assertEqual(compress(data), (data, False))
+
+    def test_max_size(self):
+        data, compressed = compress("x" * 1000, threshold=0)
+        self.assertTrue(compressed)
+        self.assertEqual(decompress(data), "x" * 1000)
+        with self.assertRaises(ProtocolError):
+            decompress(data, max_size=100)
+
+    def test_corrupted(self):
+        with self.assertRaises(ProtocolError):
+            decompress("not zlib data")
+
+
+class TestLogRecord(unittest.TestCase):
+
+    def test_roundtrip(self):
+        record = logging.LogRecord("armonic.test", logging.WARNING,
+                                   __file__, 10, "value is %s", ("foo",), None)
+        record.ip = "10.0.0.1"
+        primitive = log_record_to_primitive(record)
+        self.assertEqual(get_codec("json").loads(
+            get_codec("json").dumps(primitive)), primitive)
+        new = log_record_from_primitive(primitive)
+        self.assertEqual(new.getMessage(), "value is foo")
+        self.assertEqual(new.levelno, logging.WARNING)
+        self.assertEqual(new.levelname, "WARNING")
+        self.assertEqual(new.name, "armonic.test")
+        self.assertEqual(new.ip, "10.0.0.1")
+        self.assertEqual(new.xpath, "")
+
+
+class ListHandler(BatchingHandler):
+
+    def __init__(self, **kwargs):
+        self.batches = []
+        BatchingHandler.__init__(self, **kwargs)
+
+    def prepare(self, record):
+        return record.getMessage()
+
+    def send_batch(self, items):
+        self.batches.append(items)
+
+
+class TestBatchingHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("armonic.tests.batching")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for h in list(self.logger.handlers):
+            self.logger.removeHandler(h)
+            h.close()
+
+    def test_capacity(self):
+        handler = ListHandler(capacity=3, flush_interval=0)
+        self.logger.addHandler(handler)
+        for i in range(7):
+            self.logger.info("line %d", i)
+        self.assertEqual(handler.batches, [["line 0", "line 1", "line 2"],
+                                           ["line 3", "line 4", "line 5"]])
+        handler.close()
+        self.assertEqual(handler.batches[-1], ["line 6"])
+
+    def test_size(self):
+        handler = ListHandler(max_size=10, flush_interval=0)
+        self.logger.addHandler(handler)
+        self.logger.info("12345")
+        self.assertEqual(handler.batches, [])
+        self.logger.info("67890")
+        self.assertEqual(handler.batches, [["12345", "67890"]])
+
+    def test_interval(self):
+        handler = ListHandler(flush_interval=0.05)
+        self.logger.addHandler(handler)
+        self.logger.info("foo")
+        time.sleep(0.3)
+        self.assertEqual(handler.batches, [["foo"]])
+
+    def test_level(self):
+        handler = ListHandler(flush_interval=0)
+        handler.setLevel(logging.WARNING)
+        self.logger.addHandler(handler)
+        self.logger.info("foo")
+        self.logger.warning("bar")
+        handler.close()
+        self.assertEqual(handler.batches, [["bar"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
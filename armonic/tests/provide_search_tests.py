@@ -0,0 +1,77 @@
+import unittest
+
+from armonic import State, Lifecycle, Transition, Provide
+from armonic.serialize import Serialize
+from armonic.utils import OsTypeAll
+
+
+class SearchStateA(State):
+
+    @Provide(tags=['search', 'database'], label="Create a database",
+             help="Create a MySQL database")
+    def create_database(self):
+        pass
+
+    @Provide(tags=['search'], label="Add a user")
+    def add_user(self):
+        pass
+
+
+class SearchStateB(State):
+
+    @Provide(tags=['search', 'database'], label="Backup databases")
+    def backup(self):
+        pass
+
+
+class SearchStateC(State):
+    """Not reachable."""
+
+    @Provide(tags=['search'], label="Unreachable provide")
+    def unreachable(self):
+        pass
+
+
+class SearchLF(Lifecycle):
+    initial_state = SearchStateA()
+    transitions = [Transition(SearchStateA(), SearchStateB()),
+                   Transition(SearchStateC(), SearchStateA())]
+
+
+class TestProvideSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.lfm = Serialize(os_type=OsTypeAll())
+
+    def search(self, *args, **kwargs):
+        return self.lfm.provide_search(*args, **kwargs)
+
+    def test_tags(self):
+        self.assertEqual(self.search(['search', 'database']),
+                         {'total': 2,
+                          'provides': ["SearchLF/SearchStateA/create_database",
+                                       "SearchLF/SearchStateB/backup"]})
+
+    def test_text(self):
+        self.assertEqual(self.search(['search'], "datab")['total'], 2)
+        self.assertEqual(self.search(['search'], "MySQL")['provides'],
+                         ["SearchLF/SearchStateA/create_database"])
+        self.assertEqual(self.search(['search'], "user add")['provides'],
+                         ["SearchLF/SearchStateA/add_user"])
+        self.assertEqual(self.search(['search'], "user foo")['total'], 0)
+
+    def test_unreachable(self):
+        self.assertEqual(self.search(text="unreachable")['total'], 0)
+
+    def test_pagination(self):
+        ret = self.search(['search'], offset=1, limit=1)
+        self.assertEqual(ret['total'], 3)
+        self.assertEqual(ret['provides'], ["SearchLF/SearchStateA/create_database"])
+
+    def test_primitive(self):
+        ret = self.search(['search'], "backup", primitive=True)
+        self.assertEqual(ret['provides'][0]['extra']['label'], "Backup databases")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+from armonic.client.smart import Variable, VariableIndex, ScopeVariables
+
+
+class FakeProvide(object):
+    host = None
+    require = None
+
+    def __init__(self):
+        self.Variables = VariableIndex()
+
+
+class FakeRequire(object):
+    type = "simple"
+    special = False
+
+    def __init__(self, provide, scope):
+        self.from_provide = provide
+        self._scope_variables = scope
+
+
+def make_variable(name, require, from_xpath=None, value=None):
+    return Variable(name, require, xpath="/%s/%s" % (id(require), name),
+                    from_xpath=from_xpath, default=None, value=value,
+                    required=True, type="str", error=None,
+                    belongs_provide_ret=False, modifier=None, extra={})
+
+
+class VariableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.provide = FakeProvide()
+        self.scope = ScopeVariables()
+        self.require = FakeRequire(self.provide, self.scope)
+
+    def add(self, name, **kwargs):
+        variable = make_variable(name, self.require, **kwargs)
+        self.provide.Variables.append(variable)
+        self.scope.append(variable)
+        return variable
+
+
+class TestVariableBinding(VariableTestCase):
+
+    def test_from_xpath(self):
+        first = self.add("port", value=80)
+        self.provide.Variables.append(make_variable("port", self.require, value=8080))
+        variable = self.add("listen", from_xpath=first.xpath)
+        self.assertIs(self.provide.Variables.by_xpath(first.xpath), first)
+        self.assertEqual(variable.value, 80)
+
+    def test_scope(self):
+        a = self.add("host", value="a")
+        b = self.add("host")
+        self.add("port", value=80)
+        self.assertEqual(b.value, "a")
+        self.assertIs(b._suggested_by, a)
+        self.assertIs(a._resolved_by, b)
+        self.assertEqual(ScopeVariables(self.scope).by_name("host"), [a, b])
+
+
+class TestVariableResolutionCache(VariableTestCase):
+
+    def count_resolutions(self, variable):
+        calls = []
+        resolve = variable._resolve
+
+        def _resolve():
+            calls.append(variable)
+            return resolve()
+        variable._resolve = _resolve
+        return calls
+
+    def test_memoized(self):
+        first = self.add("port", value=80)
+        variable = self.add("listen", from_xpath=first.xpath)
+        calls = self.count_resolutions(variable)
+        self.assertEqual(variable.value, 80)
+        self.assertEqual(variable.value, 80)
+        self.assertEqual(len(calls), 1)
+
+    def test_invalidation(self):
+        first = self.add("port", value=80)
+        variable = self.add("listen", from_xpath=first.xpath)
+        last = self.add("bind", from_xpath=variable.xpath)
+        self.assertEqual(last.value, 80)
+        first.value = 8080
+        self.assertEqual(last.value, 8080)
+        first.default = 443
+        self.assertEqual(last.default_resolved, 443)
+
+    def test_from_xpath_added_later(self):
+        variable = self.add("listen", from_xpath="/port")
+        self.assertEqual(variable.value, None)
+        port = make_variable("port", self.require, value=80)
+        port.xpath = "/port"
+        self.provide.Variables.append(port)
+        self.assertEqual(variable.value, 80)
+
+    def test_scope_variable_added_later(self):
+        a = self.add("host", value="a")
+        self.assertEqual(a.value, "a")
+        b = self.add("host")
+        self.assertEqual(b.value, "a")
+        a.value = "c"
+        self.assertEqual(b.value, "c")
+
+    def test_cycle(self):
+        a = self.add("host", value="a")
+        b = self.add("host")
+        # a is resolved by b which is suggested by a
+        self.assertEqual(a.value, "a")
+        self.assertEqual(b.value, "a")
+        b.value = "b"
+        self.assertEqual(a.value, "b")
+        self.assertEqual(b.value, "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
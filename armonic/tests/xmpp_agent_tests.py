@@ -0,0 +1,74 @@
+import os
+import imp
+import logging
+import unittest
+import threading
+
+from sleekxmpp.jid import JID
+
+AGENT = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "armonic-agent-xmpp")
+agent = imp.load_source("armonic_agent_xmpp", AGENT)
+# Defined by the agent main
+agent.logger = logging.getLogger()
+
+
+class HookLock(object):
+    """A lock which calls hook once after the next release."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hook = None
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *args):
+        self.lock.release()
+        hook, self.hook = self.hook, None
+        if hook is not None:
+            hook()
+
+
+class TestMUCRooms(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = agent.XMPPAgent("agent@localhost", "password")
+        self.agent.join_muc_room = lambda deployment_id: None
+        self.agent.leave_muc_room = lambda deployment_id: None
+        self.agent.send_muc_message = lambda deployment_id, message: None
+        self.agent.muc_lock = HookLock()
+        self.caller = JID("master@localhost/client")
+
+    def tearDown(self):
+        for room in self.agent.muc_rooms_joined.values():
+            if room.timer is not None:
+                room.timer.cancel()
+            if room.handler is not None:
+                agent.logger.removeHandler(room.handler)
+                room.handler.close()
+
+    def enter_concurrently(self):
+        thread = threading.Thread(target=self.agent.enter_muc_room,
+                                  args=("deployment", self.caller))
+        thread.start()
+        thread.join()
+
+    def test_enter_during_exit(self):
+        self.agent.enter_muc_room("deployment", self.caller)
+        room = self.agent.muc_rooms_joined["deployment"]
+        handler = room.handler
+        self.addCleanup(handler.close)
+        # A call enters the room right after the last call left it
+        self.agent.muc_lock.hook = self.enter_concurrently
+        self.agent.exit_muc_room("deployment")
+        self.assertEqual(room.calls, 1)
+        self.assertIsNot(room.handler, handler)
+        self.assertIn(room.handler, agent.logger.handlers)
+        self.assertNotIn(handler, agent.logger.handlers)
+        # The removed handler is closed, its flusher is stopped
+        self.assertTrue(handler._closed.is_set())
+        self.assertFalse(handler._flusher.isAlive())
+
+
+if __name__ == '__main__':
+    unittest.main()
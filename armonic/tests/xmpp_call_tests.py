@@ -0,0 +1,175 @@
+import json
+import unittest
+import threading
+
+from armonic.xmpp.client import XMPPCallSync, PendingCall, LifecycleException, \
+    XMPPError, ENCODING_ZLIB
+
+
+class TestPendingCalls(unittest.TestCase):
+
+    def setUp(self):
+        self.client = XMPPCallSync("master@localhost", "password")
+        self.call1 = PendingCall("id1", "agent1@localhost/agent", "info")
+        self.call2 = PendingCall("id2", "agent2@localhost/agent", "info")
+
+    def add(self, *calls):
+        for call in calls:
+            self.client._pending_calls[call.call_id] = call
+
+    def result(self, call_id, value):
+        iq = self.client.Iq()
+        iq['type'] = 'set'
+        iq['to'] = "master@localhost"
+        iq['result']['call_id'] = call_id
+        iq['result']['value'] = json.dumps(value)
+        iq['result']['generation'] = "10"
+        self.client.handle_armonic_result(iq)
+
+    def exception(self, call_id):
+        iq = self.client.Iq()
+        iq.error()
+        iq['exception']['call_id'] = call_id
+        iq['exception']['code'] = "Error"
+        iq['exception']['message'] = "message"
+        self.client.handle_armonic_exception(iq['exception'])
+
+    def test_result(self):
+        self.add(self.call1, self.call2)
+        self.result("id2", [1, 2])
+        self.assertFalse(self.call1.ready.is_set())
+        self.assertTrue(self.call2.ready.is_set())
+        self.assertEqual(json.loads(self.call2.result), [1, 2])
+        self.assertEqual(self.call2.generation, 10)
+
+    def test_exception(self):
+        self.add(self.call1, self.call2)
+        self.exception("id1")
+        self.assertFalse(self.call2.ready.is_set())
+        self.assertIsInstance(self.call1.error, LifecycleException)
+        self.assertEqual(str(self.call1.error), "Error: message")
+
+    def test_unknown_call(self):
+        self.add(self.call1)
+        self.result("unknown", [])
+        self.assertFalse(self.call1.ready.is_set())
+
+    def test_without_call_id(self):
+        # Agents which don't send back call ids
+        self.add(self.call1)
+        self.result("", "foo")
+        self.assertTrue(self.call1.ready.is_set())
+        self.add(self.call2)
+        self.exception("")
+        self.assertFalse(self.call2.ready.is_set())
+
+    def chunked_result(self, call_id, value, encoding=None, order=None):
+        self.client.result_chunk_size = 10
+        chunks = self.client.split_result(value)
+        for seq in order or range(len(chunks)):
+            offset, chunk = chunks[seq]
+            iq = self.client.Iq()
+            iq['type'] = 'set'
+            iq['result']['call_id'] = call_id
+            iq['result']['value'] = chunk
+            if encoding is not None:
+                iq['result']['encoding'] = encoding
+            iq['result']['seq'] = str(seq)
+            iq['result']['total'] = str(len(chunks))
+            iq['result']['size'] = str(len(value))
+            iq['result']['offset'] = str(offset)
+            self.client.handle_armonic_result(iq)
+        return len(chunks)
+
+    def test_split_result(self):
+        self.client.result_chunk_size = 4
+        self.assertEqual(self.client.split_result("0123456789"),
+                         [(0, "0123"), (4, "4567"), (8, "89")])
+        self.assertEqual(self.client.split_result(""), [(0, "")])
+
+    def test_chunks(self):
+        self.add(self.call1)
+        value = json.dumps(range(20))
+        total = self.chunked_result("id1", value, order=[2, 0, 1, 4, 3, 5, 6])
+        self.assertEqual(total, 7)
+        self.assertTrue(self.call1.ready.is_set())
+        self.assertEqual(json.loads(self.call1.result), range(20))
+
+    def test_partial_chunks(self):
+        self.add(self.call1)
+        self.chunked_result("id1", json.dumps(range(20)), order=[0, 1])
+        self.assertFalse(self.call1.ready.is_set())
+
+    def test_encoded_chunks(self):
+        self.add(self.call1)
+        data = json.dumps(["value"] * 10000)
+        value, encoding = self.client.encode_result(data, ENCODING_ZLIB)
+        self.assertEqual(encoding, ENCODING_ZLIB)
+        self.chunked_result("id1", value, encoding)
+        self.assertEqual(self.call1.result, data)
+
+
+class FakeCallIq(object):
+    """Answer a call after a delay which depends on the agent."""
+
+    def __init__(self, client, pending):
+        self.client = client
+        self.pending = pending
+
+    def send(self, callback=None):
+        self.client.sent.append(self.pending.jid)
+        delay = self.client.delays[self.pending.jid]
+        if delay is not None:
+            threading.Timer(delay, self.answer).start()
+
+    def answer(self):
+        if self.pending.jid == "error":
+            self.pending.set_exception({'code': "Error", 'message': "message"})
+        else:
+            self.pending.set_result(json.dumps(self.pending.jid))
+
+
+class FakeCallSync(XMPPCallSync):
+    max_concurrent_calls = 2
+
+    def __init__(self, delays):
+        XMPPCallSync.__init__(self, "master@localhost", "password")
+        self.delays = delays
+        self.sent = []
+
+    def _call_iq(self, pending, deployment_id, args, kwargs, if_generation=None):
+        return FakeCallIq(self, pending)
+
+
+class TestCallMany(unittest.TestCase):
+
+    def test_order(self):
+        client = FakeCallSync({"a": 0.2, "b": 0.1, "c": 0.0})
+        results = list(client.call_many(["a", "b", "c"], None, "info"))
+        self.assertEqual(results, [("b", "b", None), ("c", "c", None), ("a", "a", None)])
+        # c is only sent when a slot is free
+        self.assertEqual(client.sent, ["a", "b", "c"])
+        self.assertEqual(client._pending_calls, {})
+
+    def test_errors(self):
+        client = FakeCallSync({"slow": None, "error": 0.0})
+        results = dict((jid, error) for jid, value, error in
+                       client.call_many(["slow", "error"], None, "info", timeout=0.2))
+        self.assertIsInstance(results["slow"], XMPPError)
+        self.assertIsInstance(results["error"], LifecycleException)
+        # slots have been released
+        self.assertEqual(list(client.call_many(["error"], None, "info"))[0][0], "error")
+        self.assertEqual(client._pending_calls, {})
+
+    def test_close(self):
+        client = FakeCallSync({"a": 0.0, "b": None})
+        results = client.call_many(["a", "b"], None, "info")
+        self.assertEqual(next(results), ("a", "a", None))
+        results.close()
+        self.assertEqual(client._pending_calls, {})
+        self.assertEqual(list(client.call_many(["a", "a"], None, "info")),
+                         [("a", "a", None)] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 """This module defines some utils used by armonic."""
 
 import re
+import time
 import platform
+import threading
 import netifaces
 from IPy import IP
 
@@ -158,6 +160,34 @@ class Singleton(type):
         return cls.instance
 
 
+class Generation(object):
+    """A counter incremented each time something a client can read
+    from the agent changes (XML registery, state stacks, provide
+    values).
+
+    Clients use it to know if data they previously fetched is still
+    valid. The counter starts at the agent start time (in
+    milliseconds) so that a generation from a previous agent run is
+    not mistaken for a current one.
+
+    This is a singleton.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = int(time.time() * 1000)
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
 class DoesNotExist(Exception):
     pass
 
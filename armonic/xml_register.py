@@ -2,6 +2,7 @@ from lxml.etree import Element, SubElement, tostring, ElementTree, XPathEvalErro
 import logging
 
 from armonic.persist import PersistRessource
+from armonic.utils import Generation
 
 
 logger = logging.getLogger(__name__)
@@ -124,6 +125,7 @@ class XMLRegistery(object):
         self._xml_register_children(xml_elt, ressource)
         logger.trace("Registered %s in XML registery" % ressource.__repr__())
         ressource._xml_on_registration()
+        Generation().bump()
 
     def _xml_register_children(self, xml_elt, ressource):
         """Be careful, this removes children before adding them."""
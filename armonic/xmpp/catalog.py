@@ -0,0 +1,200 @@
+"""Catalog of provides of all online agents.
+
+The catalog is maintained by the XMPP master: when an agent comes
+online, its provides are fetched and indexed by xpath, tag and label.
+Provides of an agent are only fetched again if the agent generation
+changed (see :py:meth:`armonic.xmpp.client.XMPPCallSync.call_conditional`)
+and they are dropped when the agent goes offline.
+
+Commands can then answer from the catalog instead of calling every
+agent.
+"""
+import re
+import time
+import logging
+import threading
+
+from armonic.client.utils import NOT_MODIFIED
+from armonic.xmpp.client import XMPPError, LifecycleException
+
+logger = logging.getLogger(__name__)
+
+
+def xpath_to_regex(xpath):
+    """Convert a simple xpath to a regex matching relative xpaths of
+    provides (Lifecycle/State/provide).
+
+    Only xpaths starting with '//' and made of names and '*' are
+    supported.
+
+    :rtype: a compiled regex or None if the xpath is not supported
+    """
+    if not xpath.startswith("//"):
+        return None
+    steps = re.findall(r"(//?)([\w\-\.]+|\*)", xpath)
+    if "".join(sep + step for sep, step in steps) != xpath:
+        return None
+    regex = ""
+    for sep, step in steps:
+        regex += "(/[^/]+)*/" if sep == "//" else "/"
+        regex += "[^/]+" if step == "*" else re.escape(step)
+    return re.compile(regex + "$")
+
+
+class AgentProvides(object):
+    """Provides of an agent at a generation."""
+
+    def __init__(self, jid, generation, provides):
+        self.jid = jid
+        self.generation = generation
+        self.provides = provides
+        self.updated = time.time()
+
+
+class ProvideCatalog(object):
+    """Provides of online agents, indexed by xpath, tag and label.
+
+    :param client: a :py:class:`armonic.xmpp.client.XMPPCallSync`
+    :param max_age: time in seconds after which provides of an agent
+        are checked again by :py:meth:`refresh_stale`
+    :param timeout: time in seconds to wait for an agent answer
+    """
+
+    def __init__(self, client, max_age=60, timeout=30):
+        self.client = client
+        self.max_age = max_age
+        self.timeout = timeout
+        self._agents = {}
+        # xpath -> {jid: provide}
+        self._by_xpath = {}
+        # tag -> set(xpath)
+        self._by_tag = {}
+        # label -> set(xpath)
+        self._by_label = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, jid):
+        """Fetch the provides of an agent if its generation changed.
+
+        :return: False if the agent didn't answer
+        """
+        with self._lock:
+            agent = self._agents.get(jid)
+        generation = agent.generation if agent is not None else None
+        try:
+            generation, provides = self.client.call_conditional(
+                jid, None, "provide", ("//*",), {},
+                if_generation=generation, timeout=self.timeout)
+        except (XMPPError, LifecycleException) as e:
+            logger.warning("Can not get provides of %s: %s" % (jid, e))
+            return False
+        with self._lock:
+            if provides is NOT_MODIFIED:
+                if jid in self._agents:
+                    self._agents[jid].updated = time.time()
+                return True
+            self._remove(jid)
+            self._add(AgentProvides(jid, generation, provides))
+        logger.debug("Catalog updated with %d provides of %s" % (len(provides), jid))
+        return True
+
+    def refresh_async(self, jid):
+        thread = threading.Thread(target=self.refresh, args=(jid,),
+                                  name="catalog-%s" % jid)
+        thread.daemon = True
+        thread.start()
+
+    def refresh_stale(self):
+        """Check again agents updated more than :py:attr:`max_age`
+        seconds ago."""
+        limit = time.time() - self.max_age
+        with self._lock:
+            stale = [a.jid for a in self._agents.values() if a.updated < limit]
+        for jid in stale:
+            self.refresh_async(jid)
+
+    def remove(self, jid):
+        """Forget the provides of an agent."""
+        with self._lock:
+            self._remove(jid)
+
+    def _add(self, agent):
+        """The lock must be held."""
+        self._agents[agent.jid] = agent
+        for provide in agent.provides:
+            xpath = provide['xpath']
+            self._by_xpath.setdefault(xpath, {})[agent.jid] = provide
+            for tag in provide['extra'].get('tags', []):
+                self._by_tag.setdefault(tag, set()).add(xpath)
+            label = provide['extra'].get('label', provide['name'])
+            self._by_label.setdefault(label, set()).add(xpath)
+
+    def _remove(self, jid):
+        """The lock must be held."""
+        agent = self._agents.pop(jid, None)
+        if agent is None:
+            return
+        for provide in agent.provides:
+            xpath = provide['xpath']
+            providers = self._by_xpath.get(xpath, {})
+            providers.pop(jid, None)
+            if providers:
+                continue
+            self._by_xpath.pop(xpath, None)
+            for index in (self._by_tag, self._by_label):
+                for key in index.keys():
+                    index[key].discard(xpath)
+                    if not index[key]:
+                        del index[key]
+
+    def agents(self):
+        with self._lock:
+            return sorted(self._agents.keys())
+
+    def provides(self):
+        """Return one provide by xpath, sorted by xpath.
+
+        :rtype: [Provide_primitive]
+        """
+        with self._lock:
+            return [self._by_xpath[xpath].values()[0]
+                    for xpath in sorted(self._by_xpath)]
+
+    def locations(self, xpath):
+        """Return agents having the provide xpath.
+
+        :rtype: [jid]
+        """
+        with self._lock:
+            return sorted(self._by_xpath.get(xpath, {}).keys())
+
+    def by_tag(self, tag):
+        """:rtype: [xpath]"""
+        with self._lock:
+            return sorted(self._by_tag.get(tag, ()))
+
+    def by_label(self, label):
+        """:rtype: [xpath]"""
+        with self._lock:
+            return sorted(self._by_label.get(label, ()))
+
+    def match(self, xpath, jid=None):
+        """Return provides matching xpath, like
+        :py:meth:`armonic.serialize.Serialize.provide`. If jid is
+        set, only provides of this agent are returned.
+
+        :return: a list of (jid, Provide_primitive) or None if the xpath
+            is not supported by :py:func:`xpath_to_regex`
+        """
+        regex = xpath_to_regex(xpath)
+        if regex is None:
+            return None
+        acc = []
+        with self._lock:
+            for provide_xpath in sorted(self._by_xpath):
+                if not regex.match("/" + provide_xpath):
+                    continue
+                for provider, provide in sorted(self._by_xpath[provide_xpath].items()):
+                    if jid is None or provider == jid:
+                        acc.append((provider, provide))
+        return acc
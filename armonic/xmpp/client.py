@@ -2,6 +2,10 @@ from __future__ import absolute_import
 
 import sys
 import json
+import time
+import uuid
+import Queue
+import base64
 import logging
 
 from sleekxmpp import ClientXMPP, Iq, Message
@@ -10,10 +14,12 @@ from sleekxmpp.exceptions import IqError, IqTimeout
 from sleekxmpp.xmlstream import register_stanza_plugin
 from sleekxmpp.xmlstream.handler import Callback
 from sleekxmpp.xmlstream.matcher import StanzaPath
-from threading import Event
+from threading import Event, Lock, BoundedSemaphore
 
 import armonic.common
-from armonic.xmpp.stanza import ArmonicResult, ArmonicLog, \
+from armonic.protocol import compress, decompress, ProtocolError
+from armonic.client.utils import GenerationCache, JobFuture, NOT_MODIFIED
+from armonic.xmpp.stanza import ArmonicResult, ArmonicLog, ArmonicLogBatch, \
     ArmonicCall, ArmonicStatus, ArmonicException
 from armonic.frontends.utils import COLOR_SEQ, RESET_SEQ, GREEN, CYAN
 
@@ -26,6 +32,9 @@ else:
 
 logger = logging.getLogger(__name__)
 
+ENCODING_ZLIB = "zlib"
+"""Results are compressed with zlib and encoded in base64."""
+
 
 class LifecycleException(Exception):
     pass
@@ -49,6 +58,10 @@ class XMPPClientBase(ClientXMPP):
     ]
     """Always loaded plugins"""
 
+    result_chunk_size = 32 * 1024
+    """Results bigger than this size (in bytes, after encoding) are
+    sent in several stanzas."""
+
     def __init__(self, jid, password, plugins=[], muc_domain=None, autoconnect=False, host=None, port=5222):
         if JID(jid).resource:
             raise InvalidJID("The provided JID shouldn't have a resource")
@@ -67,6 +80,7 @@ class XMPPClientBase(ClientXMPP):
         register_stanza_plugin(Iq, ArmonicStatus)
         register_stanza_plugin(Iq, ArmonicException)
         register_stanza_plugin(Message, ArmonicLog)
+        register_stanza_plugin(Message, ArmonicLogBatch)
 
         self.registerHandler(
             Callback('handle armonic exceptions',
@@ -135,7 +149,7 @@ class XMPPClientBase(ClientXMPP):
     def parse_json(self, data):
         return json.loads(data)
 
-    def report_exception(self, jid, exception, deployment_id=None):
+    def report_exception(self, jid, exception, deployment_id=None, call_id=None):
         iq = self.Iq()
         iq.error()
         iq['to'] = jid
@@ -144,11 +158,47 @@ class XMPPClientBase(ClientXMPP):
         iq['exception']['message'] = exception.message
         if deployment_id is not None:
             iq['exception']['deployment_id'] = deployment_id
+        if call_id:
+            iq['exception']['call_id'] = call_id
         try:
             iq.send(block=False)
         except IqTimeout:
             pass
 
+    def encode_result(self, data, accept_encoding=None):
+        """Compress a result if the caller accepts it and if it is big
+        enough (see :py:func:`armonic.protocol.compress`).
+
+        :rtype: (value, encoding) where encoding is None if the value
+            is not encoded
+        """
+        if accept_encoding == ENCODING_ZLIB:
+            compressed, is_compressed = compress(data)
+            if is_compressed:
+                return (base64.b64encode(compressed), ENCODING_ZLIB)
+        return (data, None)
+
+    def split_result(self, value):
+        """Split an encoded result in chunks of at most
+        :py:attr:`result_chunk_size` bytes.
+
+        :rtype: [(offset, chunk)]
+        """
+        size = self.result_chunk_size
+        return [(offset, value[offset:offset + size])
+                for offset in range(0, max(len(value), 1), size)]
+
+    def decode_result(self, value, encoding=None):
+        """Reverse :py:meth:`encode_result`."""
+        if not encoding:
+            return value
+        if encoding == ENCODING_ZLIB:
+            try:
+                return decompress(base64.b64decode(value))
+            except (TypeError, ProtocolError) as e:
+                raise XMPPError("Can not decode result: %s" % e)
+        raise XMPPError("Unsupported result encoding '%s'" % encoding)
+
     def _get_muc_room_name(self, id):
         return "%s@%s" % (id, self.muc_domain)
 
@@ -175,7 +225,87 @@ class XMPPClientBase(ClientXMPP):
         message.send()
 
 
+class PendingCall(object):
+    """A call waiting for its result.
+
+    :param queue: if set, the call is put in this queue when its
+        result is received
+    """
+
+    def __init__(self, call_id, jid, method, queue=None):
+        self.call_id = call_id
+        self.jid = jid
+        self.method = method
+        self.queue = queue
+        self.ready = Event()
+        self.result = None
+        self.error = None
+        self.generation = None
+        self._chunks_lock = Lock()
+        self._buffer = None
+        self._chunks = 0
+
+    def _done(self):
+        self.ready.set()
+        if self.queue is not None:
+            self.queue.put(self)
+
+    def add_chunk(self, offset, size, total, data):
+        """Store a chunk of a result sent in total chunks. Chunks can be
+        received in any order.
+
+        :return: the whole result when all chunks are received,
+            otherwise None
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        with self._chunks_lock:
+            if self._buffer is None:
+                self._buffer = bytearray(size)
+            self._buffer[offset:offset + len(data)] = data
+            self._chunks += 1
+            if self._chunks < total:
+                return None
+            result = str(self._buffer)
+            self._buffer = None
+            return result
+
+    def set_result(self, result, generation=None):
+        self.result = result
+        self.generation = generation
+        self._done()
+
+    def set_exception(self, exception):
+        """Set the exception sent by the agent."""
+        self.set_error(LifecycleException("%s: %s" % (exception['code'],
+                                                       exception['message'])))
+
+    def set_error(self, error):
+        self.error = error
+        self._done()
+
+    def __repr__(self):
+        return "<PendingCall:%s(%s,%s)>" % (self.call_id, self.jid, self.method)
+
+
 class XMPPCallSync(XMPPClientBase):
+    """Call agent methods and wait for their results.
+
+    Several calls can be done concurrently from different threads:
+    results are matched to calls with the call id sent in the call
+    stanza. At most :py:attr:`max_concurrent_calls` calls are sent at
+    the same time, other calls wait for a free slot.
+    """
+
+    compression = True
+    """If True, agents can send compressed results."""
+
+    max_concurrent_calls = 32
+    """Maximum number of calls waiting for a result."""
+
+    log_level = None
+    """Minimum level of logs agents send in the deployment MUC room. If
+    None, agents send all their logs."""
 
     def __init__(self, *args, **kwargs):
         XMPPClientBase.__init__(self, *args, **kwargs)
@@ -198,89 +328,284 @@ class XMPPCallSync(XMPPClientBase):
                                self.handle_armonic_log,
                                threaded=True)
 
-        # flag to wait for a result
-        self._result_ready = Event()
-        # This will contains the result
-        self._result_ready._result = None
-        # This is used to know if the result is an exception or not
-        self._result_ready._result_is_exception = False
+        self.registerHandler(
+            Callback('handle armonic log batches',
+                     StanzaPath('message/logs'),
+                     self._handle_armonic_logs)
+        )
+        self.add_event_handler('armonic_logs',
+                               self.handle_armonic_logs,
+                               threaded=True)
+
+        # Calls waiting for a result by call id
+        self._pending_calls = {}
+        self._pending_calls_lock = Lock()
+        self._calls_slots = BoundedSemaphore(self.max_concurrent_calls)
+
+    def _get_pending_call(self, call_id):
+        with self._pending_calls_lock:
+            if call_id:
+                return self._pending_calls.get(call_id)
+            # Agents that don't send back the call id can only be
+            # used with one call at a time
+            if len(self._pending_calls) == 1:
+                return self._pending_calls.values()[0]
+            return None
 
     def _handle_armonic_result(self, iq):
         self.event('armonic_result', iq)
 
     def handle_armonic_result(self, iq):
-        result = iq['result']['value']
+        result = iq['result']
+        call_id = result['call_id']
+        # Copy values since reply() clears the stanza
+        not_modified = result['not_modified']
+        value = result['value']
+        encoding = result['encoding']
+        generation = result['generation']
+        chunk = None
+        if result['total']:
+            chunk = (int(result['offset']), int(result['size']), int(result['total']))
 
         iq.reply()
         iq['status']['value'] = 'received'
         iq.send()
 
-        self._result_ready._result_is_exception = False
-        self._result_ready._result = result
-        self._result_ready.set()
+        pending = self._get_pending_call(call_id)
+        if pending is None:
+            logger.warning("Received a result for an unknown call '%s'" % call_id)
+            return
+        if chunk is not None:
+            value = pending.add_chunk(chunk[0], chunk[1], chunk[2], value)
+            if value is None:
+                # Waiting for other chunks
+                return
+        if not_modified:
+            value = NOT_MODIFIED
+        else:
+            try:
+                value = self.decode_result(value, encoding)
+            except XMPPError as e:
+                pending.set_error(e)
+                return
+        pending.set_result(value, int(generation) if generation else None)
 
     def handle_armonic_exception(self, exception):
-        self._result_ready._result_is_exception = True
-        self._result_ready._result = exception
-        self._result_ready.set()
+        pending = self._get_pending_call(exception['call_id'])
+        if pending is None:
+            XMPPClientBase.handle_armonic_exception(self, exception)
+            return
+        pending.set_exception(exception)
 
     def _handle_armonic_log(self, message):
         self.event('armonic_log', message)
 
     def handle_armonic_log(self, msg):
-        logger_method = logger.info
-        if msg['log']:
-            try:
-                logger_method = getattr(logger, msg['log']['level_name'])
-            except AttributeError:
-                logger_method = logger.info
+        self._log_armonic_message(msg['from'].resource, msg['body'],
+                                  msg['log']['level'], msg['log']['level_name'])
+
+    def _handle_armonic_logs(self, message):
+        self.event('armonic_logs', message)
+
+    def handle_armonic_logs(self, msg):
+        for entry in msg['logs']:
+            self._log_armonic_message(msg['from'].resource, entry['message'],
+                                      entry['level'], entry['level_name'])
+        if msg['logs']['dropped']:
+            logger.warning("[%s] %s log records dropped" % (msg['from'].resource,
+                                                             msg['logs']['dropped']))
+
+    def _log_armonic_message(self, sender, body, level, level_name):
+        try:
+            logger_method = getattr(logger, level_name)
+        except (AttributeError, TypeError):
+            logger_method = logger.info
 
-        message = '[%s%s%s] %s%s%s' % (COLOR_SEQ % GREEN, msg['from'].resource, RESET_SEQ,
-                                       COLOR_SEQ % CYAN, msg['body'], RESET_SEQ)
+        message = '[%s%s%s] %s%s%s' % (COLOR_SEQ % GREEN, sender, RESET_SEQ,
+                                       COLOR_SEQ % CYAN, body, RESET_SEQ)
 
         # !FIXME hack so that the logger.process prints the line
-        if int(msg['log']['level']) == armonic.common.PROCESS_LEVEL:
+        if level and int(level) == armonic.common.PROCESS_LEVEL:
             message += "\n"
 
         logger_method(message)
 
     def call(self, jid, deployment_id, method, *args, **kwargs):
+        return self.call_conditional(jid, deployment_id, method, args, kwargs)[1]
+
+    def agents(self):
+        """Return the JIDs of online agents of the roster."""
+        return ["%s/agent" % jid for jid in self.client_roster
+                if 'agent' in self.client_roster[jid].resources]
+
+    def _call_iq(self, pending, deployment_id, args, kwargs, if_generation=None):
         iq = self.Iq()
-        iq['to'] = jid
+        iq['to'] = pending.jid
         iq['type'] = 'set'
-        iq['call']['method'] = method
+        iq['call']['call_id'] = pending.call_id
+        iq['call']['method'] = pending.method
         iq['call']['params'] = json.dumps({'args': args, 'kwargs': kwargs})
+        if self.compression:
+            iq['call']['accept_encoding'] = ENCODING_ZLIB
+        if if_generation is not None:
+            iq['call']['if_generation'] = str(if_generation)
+        if self.log_level is not None:
+            iq['call']['log_level'] = str(self.log_level)
         if deployment_id is not None:
             iq['call']['deployment_id'] = deployment_id
+        return iq
+
+    def _add_pending_call(self, pending):
+        with self._pending_calls_lock:
+            self._pending_calls[pending.call_id] = pending
+
+    def _remove_pending_call(self, pending):
+        with self._pending_calls_lock:
+            self._pending_calls.pop(pending.call_id, None)
+
+    def _pending_call_value(self, pending):
+        """:rtype: (generation, value)"""
+        if pending.error is not None:
+            raise pending.error
+        if pending.result is NOT_MODIFIED:
+            return (pending.generation, NOT_MODIFIED)
+        return (pending.generation, json.loads(pending.result))
+
+    def call_conditional(self, jid, deployment_id, method, args, kwargs,
+                         if_generation=None, timeout=None):
+        """Call a method. If if_generation is the current agent
+        generation, the returned value is
+        :py:data:`armonic.client.utils.NOT_MODIFIED`.
+
+        :param timeout: time in seconds to wait for the result. By
+            default, wait forever.
+        :rtype: (generation, value)
+        """
+        pending = PendingCall(uuid.uuid4().hex, jid, method)
+        iq = self._call_iq(pending, deployment_id, args, kwargs, if_generation)
+
+        with self._calls_slots:
+            self._add_pending_call(pending)
+            try:
+                try:
+                    resp = iq.send()
+                except IqError:
+                    logger.error("Failed to send message to %s" % jid)
+                    raise XMPPError("Failed to contact %s" % jid)
+
+                if not resp['status']['value'] == 'executing':
+                    logger.error(resp)
+
+                # Waiting for a result
+                if not pending.ready.wait(timeout):
+                    raise XMPPError("No result from %s for %s after %s seconds" % (
+                        jid, method, timeout))
+            finally:
+                self._remove_pending_call(pending)
+
+        return self._pending_call_value(pending)
+
+    def call_many(self, jids, deployment_id, method, args=(), kwargs={}, timeout=30):
+        """Call the same method on several agents concurrently.
+
+        This is a generator which yields results as they arrive, as
+        (jid, value, error) tuples. error is None if the call
+        succeeded, otherwise it is the :py:class:`LifecycleException`
+        or :py:class:`XMPPError` the call raised. An agent which doesn't
+        answer timeout seconds after its call is yielded with an
+        :py:class:`XMPPError`.
+
+        Calls share the :py:attr:`max_concurrent_calls` slots with
+        other calls: when there is no free slot, next agents are called
+        when previous calls are done.
+        """
+        results = Queue.Queue()
+        waiting = list(jids)
+        in_flight = {}
+
+        def send(jid):
+            pending = PendingCall(uuid.uuid4().hex, jid, method, queue=results)
+            pending.deadline = None
+            if timeout is not None:
+                pending.deadline = time.time() + timeout
+            in_flight[pending.call_id] = pending
+            self._add_pending_call(pending)
+
+            def sent(resp):
+                if resp['type'] == 'error':
+                    pending.set_error(XMPPError("Failed to contact %s" % jid))
+            self._call_iq(pending, deployment_id, args, kwargs).send(callback=sent)
+
+        def finish(pending):
+            self._remove_pending_call(pending)
+            del in_flight[pending.call_id]
+            self._calls_slots.release()
+
         try:
-            resp = iq.send()
-        except IqError:
-            logger.error("Failed to send message to %s" % jid)
-            raise XMPPError("Failed to contact %s" % jid)
-
-        if not resp['status']['value'] == 'executing':
-            logger.error(resp)
-
-        # Waiting for a result
-        self._result_ready.wait()
-        self._result_ready.clear()
-        if self._result_ready._result_is_exception:
-            raise LifecycleException("%s: %s" % (
-                self._result_ready._result['code'],
-                self._result_ready._result['message']))
-        else:
-            return json.loads(self._result_ready._result)
+            while waiting or in_flight:
+                while waiting and self._calls_slots.acquire(False):
+                    send(waiting.pop(0))
+                if not in_flight:
+                    # All slots are used by other threads
+                    self._calls_slots.acquire()
+                    send(waiting.pop(0))
+
+                deadlines = [p.deadline for p in in_flight.values()
+                             if p.deadline is not None]
+                wait = None
+                if deadlines:
+                    wait = max(0, min(deadlines) - time.time())
+                if waiting:
+                    # Slots can be released by other threads
+                    wait = min(wait, 0.5) if wait is not None else 0.5
+                try:
+                    pending = results.get(timeout=wait)
+                except Queue.Empty:
+                    now = time.time()
+                    for pending in in_flight.values():
+                        if pending.deadline is not None and pending.deadline <= now:
+                            finish(pending)
+                            yield (pending.jid, None, XMPPError(
+                                "No result from %s for %s after %s seconds" % (
+                                    pending.jid, method, timeout)))
+                    continue
+
+                if pending.call_id not in in_flight:
+                    # This call already timed out
+                    continue
+                finish(pending)
+                try:
+                    value, error = self._pending_call_value(pending)[1], None
+                except (LifecycleException, XMPPError) as e:
+                    value, error = None, e
+                yield (pending.jid, value, error)
+        finally:
+            for pending in in_flight.values():
+                finish(pending)
 
 
 class XMPPAgentApi(object):
+    """Call methods of an agent.
+
+    :param cache: if True, results of read methods are cached and
+        only fetched again if the agent generation changed (see
+        :py:class:`armonic.client.utils.GenerationCache`)
+    """
 
-    def __init__(self, client, agent_jid, deployment_id=None):
+    def __init__(self, client, agent_jid, deployment_id=None, cache=True):
         self.client = client
         self.jid = agent_jid
         self.deployment_id = deployment_id
+        self.cache = GenerationCache() if cache else None
 
     def call(self, method, *args, **kwargs):
-        return self.client.call(self.jid, self.deployment_id, method, *args, **kwargs)
+        if self.cache is None:
+            return self.client.call(self.jid, self.deployment_id, method, *args, **kwargs)
+        return self.cache.call(
+            method, args, kwargs,
+            lambda generation: self.client.call_conditional(self.jid, self.deployment_id,
+                                                            method, args, kwargs,
+                                                            generation))
 
     def info(self):
         return self.call("info")
@@ -306,6 +631,17 @@ class XMPPAgentApi(object):
     def provide(self, provide_xpath):
         return self.call("provide", provide_xpath=provide_xpath)
 
+    def provide_search(self, tags=[], text=None, primitive=False, offset=0, limit=50):
+        return self.call("provide_search", tags=tags, text=text,
+                         primitive=primitive, offset=offset, limit=limit)
+
+    def process_outputs(self):
+        return self.call("process_outputs")
+
+    def process_output(self, output_id, offset=0, size=64 * 1024):
+        return self.call("process_output", output_id=output_id,
+                         offset=offset, size=size)
+
     def provide_call_path(self, provide_xpath):
         return self.call("provide_call_path", provide_xpath=provide_xpath)
 
@@ -319,6 +655,16 @@ class XMPPAgentApi(object):
                          provide_xpath_uri=provide_xpath_uri,
                          requires=requires, path_idx=path_idx)
 
+    def provide_call_async(self, provide_xpath_uri, requires=[], path_idx=0):
+        """Start a provide call on the agent.
+
+        :rtype: :py:class:`armonic.client.utils.JobFuture`
+        """
+        job_id = self.call("provide_call_async",
+                           provide_xpath_uri=provide_xpath_uri,
+                           requires=requires, path_idx=path_idx)
+        return JobFuture(self, job_id)
+
     def state(self, xpath, doc=False):
         return self.call("state", xpath=xpath, doc=doc)
 
@@ -327,6 +673,12 @@ class XMPPAgentApi(object):
                          xpath=xpath,
                          requires=requires)
 
+    def state_goto_plans(self):
+        return self.call("state_goto_plans")
+
+    def state_goto_resume(self, xpath):
+        return self.call("state_goto_resume", xpath=xpath)
+
     def state_current(self, xpath):
         return self.call("state_current",
                          xpath=xpath)
@@ -1,19 +1,34 @@
-from sleekxmpp.xmlstream import ElementBase
+from sleekxmpp.xmlstream import ElementBase, register_stanza_plugin
 
 
 class ArmonicCall(ElementBase):
     """
     A stanza class for XML content of the form:
     <call xmlns="armonic">
+      <call_id>X</call_id>
       <deployment_id>X</deployment_id>
       <method>X</method>
       <params>X</params>
+      <accept_encoding>zlib</accept_encoding>
+      <if_generation>X</if_generation>
+      <log_level>X</log_level>
     </call>
+
+    accept_encoding is optional. If set, the result can be encoded.
+
+    if_generation is optional. If set and the agent generation is
+    still the same, the agent replies with a not_modified result.
+
+    call_id is sent back in the result or exception of the call.
+
+    log_level is optional. It is the minimum level of logs the caller
+    wants to receive in the deployment MUC room.
     """
     name = 'call'
     namespace = 'armonic'
     plugin_attrib = 'call'
-    interfaces = set(('method', 'params', 'deployment_id'))
+    interfaces = set(('call_id', 'method', 'params', 'deployment_id',
+                      'accept_encoding', 'if_generation', 'log_level'))
     sub_interfaces = interfaces
 
 
@@ -36,25 +51,48 @@ class ArmonicResult(ElementBase):
     """
     A stanza class for XML content of the form:
     <result xmlns="armonic">
+      <call_id>X</call_id>
       <deployment_id>X</deployment_id>
       <value>X</value>
+      <encoding>zlib</encoding>
+      <generation>X</generation>
+      <not_modified>true</not_modified>
+      <seq>X</seq>
+      <total>X</total>
+      <size>X</size>
+      <offset>X</offset>
     </result>
+
+    If encoding is zlib, value is the base64 of the zlib compressed
+    value.
+
+    generation is the agent generation when the call has been
+    done. If not_modified is set, there is no value: the result has
+    not changed since the generation asked by the call.
+
+    Big results are sent in several result stanzas. Each one contains
+    a chunk of the (encoded) value, its sequence number seq, the
+    number of chunks total, the size of the whole value and the
+    offset of the chunk in the value.
     """
     name = 'result'
     namespace = 'armonic'
     plugin_attrib = 'result'
-    interfaces = set(('value', 'deployment_id'))
+    interfaces = set(('call_id', 'value', 'deployment_id', 'encoding',
+                      'generation', 'not_modified', 'seq', 'total', 'size',
+                      'offset'))
     sub_interfaces = interfaces
 
 
 class ArmonicException(ElementBase):
     """
-    A stanza class to send armonic exception over XMPP
+    A stanza class to send armonic exception over XMPP. call_id is
+    the id of the call which raised the exception.
     """
     name = 'exception'
     namespace = 'armonic'
     plugin_attrib = 'exception'
-    interfaces = set(('code', 'message', 'deployment_id'))
+    interfaces = set(('code', 'message', 'deployment_id', 'call_id'))
     sub_interfaces = interfaces
 
 
@@ -64,3 +102,42 @@ class ArmonicLog(ElementBase):
     plugin_attrib = 'log'
     interfaces = set(('level', 'level_name', 'deployment_id'))
     sub_interfaces = interfaces
+
+
+class ArmonicLogEntry(ElementBase):
+    """
+    A log record of a :py:class:`ArmonicLogBatch`:
+    <entry level="20" level_name="info" created="1400000000.0">message</entry>
+    """
+    name = 'entry'
+    namespace = 'armonic'
+    plugin_attrib = 'entry'
+    interfaces = set(('level', 'level_name', 'created', 'message'))
+
+    def get_message(self):
+        return self.xml.text or ""
+
+    def set_message(self, value):
+        self.xml.text = value
+
+    def del_message(self):
+        self.xml.text = None
+
+
+class ArmonicLogBatch(ElementBase):
+    """
+    A stanza class to send several log records in one message:
+    <logs xmlns="armonic" deployment_id="X" dropped="N">
+      <entry level="20" level_name="info" created="X">message</entry>
+      ...
+    </logs>
+
+    dropped is the number of records which have not been sent since
+    the previous batch because of rate limiting.
+    """
+    name = 'logs'
+    namespace = 'armonic'
+    plugin_attrib = 'logs'
+    interfaces = set(('deployment_id', 'dropped'))
+
+register_stanza_plugin(ArmonicLogBatch, ArmonicLogEntry, iterable=True)
@@ -0,0 +1,86 @@
+"""Measure the overhead per state transition of persisting the agent
+state: without persistence, with the state_goto plans journal only
+and with the background checkpointer (group commit).
+
+Usage: PYTHONPATH=. python bench/checkpoint.py [n_lifecycles] [n_rounds]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+from lifecycles import make_lifecycles
+
+from armonic.utils import OsTypeAll
+from armonic.persist import Persist
+from armonic.lifecycle import LifecycleManager
+
+N_STATES = 5
+
+
+class CountingStore(object):
+    """Count the transactions of the store of a Persist."""
+
+    def __init__(self, persist):
+        self.transactions = 0
+        self.store = persist.store
+        self.write = self.store.write
+        self.store.write = self._write
+
+    def _write(self, *args, **kwargs):
+        self.transactions += 1
+        return self.write(*args, **kwargs)
+
+
+def run_transitions(lfm, lifecycles, n_rounds):
+    """Go up and down the state chain of all lifecycles.
+
+    :return: the number of transitions and the elapsed time
+    """
+    transitions = 0
+    start = time.time()
+    for i in range(n_rounds):
+        for lifecycle in lifecycles:
+            name = lifecycle.__name__
+            for target in (N_STATES - 1, 0):
+                lfm.state_goto("//%s/%sState%d" % (name, name, target))
+                transitions += N_STATES - 1
+    return transitions, time.time() - start
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    n_lifecycles = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    lifecycles = make_lifecycles(n_lifecycles, n_states=N_STATES)
+    tmp = tempfile.mkdtemp()
+    persist = Persist()
+    persist.state_path = os.path.join(tmp, "state.db")
+    persist.save_state = True
+    lfm = LifecycleManager(os_type=OsTypeAll())
+    try:
+        persist.save_state = False
+        transitions, reference = run_transitions(lfm, lifecycles, n_rounds)
+        print "%d transitions" % transitions
+        print "  no persistence: %.1f us/transition" % (reference / transitions * 1e6)
+        persist.save_state = True
+        counter = CountingStore(persist)
+
+        for interval in (None, 0.01, 0.1, 1.0):
+            counter.transactions = 0
+            if interval is not None:
+                persist.start_checkpointer(interval)
+            _, elapsed = run_transitions(lfm, lifecycles, n_rounds)
+            persist.stop_checkpointer()
+            name = "checkpointer %.2fs" % interval if interval else "plans journal only"
+            print "  %s: %.1f us/transition (+%.1f), %d transactions" % (
+                name, elapsed / transitions * 1e6,
+                (elapsed - reference) / transitions * 1e6, counter.transactions)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
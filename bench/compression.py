@@ -0,0 +1,69 @@
+"""Measure the size of large agent responses with and without zlib
+compression and the time spent to compress and decompress them.
+
+Usage: PYTHONPATH=. python bench/compression.py [n_lifecycles]
+"""
+import sys
+import json
+import time
+import zlib
+import base64
+import logging
+
+from lifecycles import make_lifecycles
+
+from armonic.utils import OsTypeAll
+from armonic.serialize import Serialize
+from armonic.protocol import get_codec, codec_names
+
+BANDWIDTHS = [1, 10, 100]  # in Mbit/s
+REPEAT = 5
+
+
+def timeit(func, *args):
+    start = time.time()
+    for i in range(REPEAT):
+        ret = func(*args)
+    return ret, (time.time() - start) / REPEAT
+
+
+def transfer_time(size, mbits):
+    return size * 8 / (mbits * 1000.0 * 1000.0)
+
+
+def report(name, data):
+    print "%s: %d bytes" % (name, len(data))
+    for level in (1, 6, 9):
+        compressed, t_compress = timeit(zlib.compress, data, level)
+        _, t_decompress = timeit(zlib.decompress, compressed)
+        print "  zlib level %d: %d bytes (%.1f%%), compress %.2f ms, decompress %.2f ms" % (
+            level, len(compressed), 100.0 * len(compressed) / len(data),
+            t_compress * 1000, t_decompress * 1000)
+        if level == 6:
+            print "  base64 (xmpp): %d bytes" % len(base64.b64encode(compressed))
+            for mbits in BANDWIDTHS:
+                raw = transfer_time(len(data), mbits)
+                total = t_compress + transfer_time(len(compressed), mbits) + t_decompress
+                print "  %4d Mbit/s: raw %.1f ms, compressed %.1f ms" % (
+                    mbits, raw * 1000, total * 1000)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    n_lifecycles = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    make_lifecycles(n_lifecycles)
+    lfm = Serialize(os_type=OsTypeAll())
+
+    payloads = [("to_xml", lfm.to_xml("/*")),
+                ("xpath //*", lfm.xpath("//*")),
+                ("provide //*", lfm.provide("//*")),
+                ("state doc", lfm.state("//*[@ressource='state']", doc=True))]
+    for name, payload in payloads:
+        for codec in codec_names():
+            if name == "to_xml" and codec != "json":
+                continue
+            report("%s (%s)" % (name, codec), get_codec(codec).dumps(payload))
+            print
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Helpers to build synthetic lifecycles for benchmarks."""
+from armonic import Lifecycle, State, Transition, Provide, Require
+from armonic.variable import VString
+
+
+def _make_provide(name, n_variables, tags):
+    def provide(self, requires):
+        return {}
+    provide.__name__ = name
+    variables = [VString("variable_%d" % v,
+                         default="default value %d" % v,
+                         label="Variable %d" % v,
+                         help="Help message of variable %d" % v)
+                 for v in range(n_variables)]
+    provide = Require("conf", variables)(provide)
+    return Provide(label="Provide %s" % name,
+                   help="Long help message of provide %s" % name,
+                   tags=tags)(provide)
+
+
+def make_lifecycles(n_lifecycles, n_states=5, n_provides=4, n_variables=3):
+    """Define n_lifecycles lifecycles. Each lifecycle is a chain of
+    n_states states and each state has n_provides provides.
+
+    A LifecycleManager has to be created after to load them.
+    """
+    lifecycles = []
+    for i in range(n_lifecycles):
+        states = []
+        for j in range(n_states):
+            attrs = {}
+            for k in range(n_provides):
+                name = "provide_%d" % k
+                tags = ["bench", "lifecycle_%d" % i, "provide_%d" % k]
+                attrs[name] = _make_provide(name, n_variables, tags)
+            state_class = type("Bench%dState%d" % (i, j), (State,), attrs)
+            states.append(state_class())
+        transitions = [Transition(states[j], states[j + 1])
+                       for j in range(n_states - 1)]
+        lifecycles.append(type("Bench%d" % i, (Lifecycle,),
+                               {'initial_state': states[0],
+                                'transitions': transitions}))
+    return lifecycles
@@ -0,0 +1,90 @@
+"""Compare the time spent to capture the output of a verbose process
+with the previous byte by byte implementation of
+ProcessThread.catch_output and the current chunked one.
+
+Usage: PYTHONPATH=. python bench/process_output.py [n_lines ...]
+"""
+import os
+import sys
+import time
+import select
+import logging
+
+import armonic.common
+from armonic.process import ProcessThread
+
+LINE = "Unpacking libfoo-dev (1.2.3-4) over (1.2.3-3) ...\n"
+
+
+class LegacyProcessThread(ProcessThread):
+    """ProcessThread reading the output one byte at a time."""
+
+    def catch_output(self):
+        output = ""
+        while self.isAlive():
+            try:
+                fd = select.select([self.process.stdout.fileno()],
+                    [], [], 5)[0][0]
+            except IndexError:
+                fd = None
+
+            self.process.poll()
+            if self.process.returncode == None:
+                if fd:
+                    output += os.read(fd, 1)
+                    if output != "":
+                        logging.getLogger("armonic.process").process(output[-1])
+            else:
+                if fd:
+                    while True:
+                        data = os.read(fd, 4096)
+                        if data == None or data == "":
+                            break
+                        logging.getLogger("armonic.process").process(data)
+                        output += data
+                self._output = bytearray(output)
+                self._code = self.process.returncode
+                break
+
+
+class CountHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = 0
+
+    def emit(self, record):
+        self.records += 1
+
+
+def command(n_lines):
+    return [sys.executable, "-c",
+            "import sys\nfor i in range(%d): sys.stdout.write(%r)" % (n_lines, LINE)]
+
+
+def measure(cls, n_lines, handler):
+    handler.records = 0
+    thread = cls("bench", None, "bench", command(n_lines))
+    start = time.time()
+    thread.launch()
+    elapsed = time.time() - start
+    assert len(thread.output) == n_lines * len(LINE), len(thread.output)
+    return elapsed, handler.records
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000, 50000]
+    handler = CountHandler()
+    logger = logging.getLogger("armonic.process")
+    logger.addHandler(handler)
+    logger.setLevel(armonic.common.PROCESS_LEVEL)
+    logger.propagate = False
+
+    print "%10s %10s | %12s %10s | %12s %10s | %8s" % (
+        "lines", "bytes", "legacy (s)", "records", "chunked (s)", "records", "speedup")
+    for n_lines in sizes:
+        legacy, legacy_records = measure(LegacyProcessThread, n_lines, handler)
+        chunked, chunked_records = measure(ProcessThread, n_lines, handler)
+        print "%10d %10d | %12.3f %10d | %12.3f %10d | %7.1fx" % (
+            n_lines, n_lines * len(LINE), legacy, legacy_records,
+            chunked, chunked_records, legacy / chunked)